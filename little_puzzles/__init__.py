@@ -1,4 +1,19 @@
 '''little-puzzles: a collection of number puzzle generators and solvers.
+
+Submodules are imported on first use, so that importing the package (or
+running its command line on a small puzzle) does not pay for NumPy.
 '''
-import numpy as np
-from . import triangle_puzzle
+import importlib
+
+_SUBMODULES = ('triangle_puzzle', 'triangle_archive', 'benchmark', 'server',
+               'cli', 'dedupe')
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES))
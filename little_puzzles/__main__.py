@@ -0,0 +1,7 @@
+'''
+Runs the little-puzzles command line: python -m little_puzzles.
+'''
+import sys
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,229 @@
+'''
+Pure-Python pieces of the triangle puzzle: reading and rendering the text
+layout and searching small triangles. Nothing here imports NumPy, so the
+command line can answer small puzzles without paying for it; the NumPy
+module builds on the same helpers.
+
+Triangles are passed around as lists of rows.
+'''
+
+import functools
+
+
+def iter_txt_records(lines):
+    '''
+    Splits the lines of a multi-puzzle text file into puzzles, laid out as
+    TrianglePuzzle.display() writes them. A puzzle starts at its target
+    line or, when it has no target, at its top row: the only row holding a
+    single value.
+
+    Parameters
+    ----------------------------------
+    lines : iterable of str
+
+    Yields
+    ----------------------------------
+    rows : list of lists of ints
+    target : int or None
+        None for a puzzle written without a target
+    solution : str or None
+    '''
+    rows = []
+    target = None
+    solution = None
+    for line in lines:
+        kind, content = _parse_txt_line(line)
+        if kind == 'row':
+            if rows and len(content) == 1:
+                yield rows, _txt_target(target), solution
+                rows, target, solution = [], None, None
+            rows.append(content)
+        elif kind == 'target':
+            if target is not None or rows:
+                yield rows, _txt_target(target), solution
+                rows, solution = [], None
+            target = content
+        elif kind == 'solution':
+            solution = content
+    if target is not None or rows:
+        yield rows, _txt_target(target), solution
+
+
+def render(write, rows, target, solution=None, show_solution=False,
+           spacing=4, line_spacing=1, values=None, largest=None):
+    '''
+    Writes the target, the triangle and (optionally) the solution, one call
+    to write for each, in the layout of TrianglePuzzle.display().
+
+    Parameters
+    ----------------------------------
+    write : callable
+        called with each formatted section, such as a stream's write
+    rows : list of lists of ints or None
+    target : int or None
+    solution : str or None
+    values : list of ints, default=None
+        the values of rows, flat, when the caller already has them
+    largest : int, default=None
+        the largest value, when the caller already has it
+    '''
+    newlines = '\n' * line_spacing
+    if target:
+        write(f'Target: {target}{newlines}')
+    if rows:
+        if values is None:
+            values = [value for row in rows for value in row]
+        write(_format_values(values, len(rows), spacing=spacing,
+                             newlines=newlines, largest=largest))
+    if show_solution and solution:
+        write(f'Solution: {solution}\n')
+
+
+def solve_rows(rows, target):
+    '''
+    Finds the left-first path whose product is the target, remembering the
+    (cell, remaining target) states that lead nowhere.
+
+    Returns
+    ----------------------------------
+    solution : str
+        consisting of 'L' and 'R' indicating the moves in the solution
+    '''
+    target = int(target)
+    last_row = len(rows) - 1
+    dead = set()
+
+    def search(row, position, remaining):
+        if remaining % rows[row][position]:
+            return None
+        remaining //= rows[row][position]
+        if row == last_row:
+            return '' if remaining == 1 else None
+        if (row, position, remaining) in dead:
+            return None
+        for direction, move in enumerate('LR'):
+            rest = search(row + 1, position + direction, remaining)
+            if rest is not None:
+                return move + rest
+        dead.add((row, position, remaining))
+        return None
+
+    solution = search(0, 0, target) if rows and target > 0 else None
+    if solution is None:
+        raise ValueError('There is no solution to this puzzle.')
+    return solution
+
+
+def count_rows(rows, target):
+    '''
+    Counts the paths whose product is the target, row by row over the
+    remaining targets that still divide it.
+
+    Returns
+    ----------------------------------
+    n_solutions : int
+    '''
+    target = int(target)
+    if not rows or target < 1:
+        return 0
+    cells = [{target: 1}]
+    for row, values in enumerate(rows):
+        new_cells = []
+        for position, value in enumerate(values):
+            cell = {}
+            for parent in cells[max(position - 1, 0):position + 1]:
+                for remaining, count in parent.items():
+                    if remaining % value == 0:
+                        quotient = remaining // value
+                        cell[quotient] = cell.get(quotient, 0) + count
+            new_cells.append(cell)
+        cells = new_cells
+    return sum(cell.get(1, 0) for cell in cells)
+
+
+def check_rows(rows):
+    '''
+    Checks that rows are a triangle of positive ints, the first row holding
+    one value and every row one more than the row above, as
+    TrianglePuzzle.set_triangle() requires.
+
+    Raises
+    ----------------------------------
+    ValueError
+        describing the first problem found
+    '''
+    if not isinstance(rows, list) or not rows:
+        raise ValueError('The triangle must be a non-empty list of rows.')
+    for row, values in enumerate(rows):
+        if not isinstance(values, list) or len(values) != row + 1:
+            raise ValueError(f'Row {row + 1} of the triangle must hold '
+                             f'{row + 1} values.')
+        for value in values:
+            if (not isinstance(value, int) or isinstance(value, bool)
+                    or value < 1):
+                raise ValueError(f'Row {row + 1} of the triangle holds '
+                                 f'{value!r}, values must be positive ints.')
+
+
+def _parse_txt_line(line):
+    '''
+    Helper function for reading puzzles from text. Lines starting with a
+    digit are triangle rows, a 'Solution:' line holds the solution and any
+    other non-blank line holds the target.
+
+    Returns
+    ----------------------------------
+    kind : str or None
+        'row', 'target', 'solution', or None for a blank line
+    content : list of ints, str or None
+    '''
+    line = line.strip()
+    if not line:
+        return None, None
+    if line[0].isdigit():
+        return 'row', [int(s) for s in line.replace(',', ' ').split()]
+    if line.startswith('Solution:'):
+        return 'solution', line[len('Solution:'):].strip()
+    return 'target', [int(s) for s in line.split(' ') if s.isdigit()]
+
+
+def _txt_target(target):
+    '''
+    Helper function for reading puzzles from text. Checks that at most one
+    target was found, None standing for no target line at all.
+    '''
+    if target is None:
+        return None
+    elif len(target) > 1:
+        raise ValueError('More than one target was specified in the file.')
+    elif len(target) < 1:
+        raise ValueError('Could not find a target value in the file.')
+    return target[0]
+
+
+def _format_values(values, n_rows, spacing=4, newlines='\n',
+                   largest=None):
+    '''
+    Helper function for render(). Lays the flat values of a triangle out on
+    a grid of half-columns. The column width is worked out once for the
+    whole triangle, wide enough for its longest value, and the whole
+    triangle is then filled into a cached format string in one call.
+
+    Returns
+    ----------------------------------
+    triangle_str : str
+    '''
+    longest = len(str(max(values) if largest is None else largest))
+    half = max(spacing, (longest + 2) // 2)
+    return _triangle_template(n_rows, half, newlines).format(*values)
+
+
+@functools.lru_cache(maxsize=256)
+def _triangle_template(n_rows, half, newlines):
+    '''
+    Helper function for _format_values(). Builds the format string of a
+    triangle with n_rows rows on half-columns half characters wide.
+    '''
+    cell = f'{{:<{2 * half}}}'
+    return ''.join(' ' * (half * (n_rows - 1 - row)) + cell * row + '{}'
+                   + newlines for row in range(n_rows))
@@ -0,0 +1,210 @@
+'''
+Benchmarks for the hot paths of the triangle puzzle: solving, generating,
+validating, reading and displaying, swept over the number of rows.
+
+Every benchmark runs on puzzles generated from a fixed seed, so two runs on
+the same machine time the same work. Run it from the command line:
+
+    python -m little_puzzles.benchmark --output timings.json
+    python -m little_puzzles.benchmark --baseline timings.json
+
+With a baseline, every benchmark slower (or hungrier for memory) than the
+baseline by more than the threshold is flagged and the exit status is 1.
+'''
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+import tracemalloc
+import numpy as np
+from .triangle_puzzle import TrianglePuzzle
+
+ROWS = (4, 8, 12, 16)
+LEVELS = ('easy', 'medium', 'hard')
+SOLVE_METHODS = ('dfs', 'dp')
+
+
+def benchmark_cases(rows=ROWS, seed=0, directory=None):
+    '''
+    Lists the benchmarks to run.
+
+    Parameters
+    ----------------------------------
+    rows : iterable of int
+        numbers of rows to sweep over
+    seed : int
+        seed of the puzzle fixtures
+    directory : str
+        where to write the files read by the read_txt_file benchmarks
+
+    Yields
+    ----------------------------------
+    name : str
+    params : dict
+    run : callable
+        does the work being timed
+    '''
+    for n_rows in rows:
+        puzzle = _fixture(n_rows, seed=seed)
+        unsolved = TrianglePuzzle(puzzle.triangle)
+        for method in SOLVE_METHODS:
+            yield ('solve', {'n_rows': n_rows, 'method': method},
+                   lambda puzzle=puzzle, method=method: puzzle.solve(method))
+        for level in LEVELS:
+            yield ('make_random', {'n_rows': n_rows, 'level': level},
+                   lambda n_rows=n_rows, level=level: TrianglePuzzle()
+                   .make_random(n_rows, level, random_state=seed))
+        yield ('_is_valid_puzzle', {'n_rows': n_rows, 'target': True},
+               puzzle._is_valid_puzzle)
+        yield ('_is_valid_puzzle', {'n_rows': n_rows, 'target': False},
+               unsolved._is_valid_puzzle)
+        if directory is not None:
+            path = os.path.join(directory, f'puzzle_{n_rows}.txt')
+            puzzle.puzzle_to_txt(path, show_solution=True)
+            yield ('read_txt_file', {'n_rows': n_rows},
+                   lambda path=path: TrianglePuzzle().read_txt_file(path))
+        yield ('display', {'n_rows': n_rows},
+               lambda puzzle=puzzle: puzzle.display(show_solution=True,
+                                                    quiet=True))
+
+
+def run_benchmarks(rows=ROWS, repeat=5, seed=0):
+    '''
+    Times every benchmark and measures its peak memory.
+
+    Each benchmark is run in a loop long enough to time reliably, repeat
+    times, and the fastest loop is kept. Peak memory is the most memory
+    traced by tracemalloc during one extra run.
+
+    Returns
+    ----------------------------------
+    results : list of dict
+        name, params, seconds (per run), median_seconds and peak_bytes of
+        each benchmark
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, params, run in benchmark_cases(rows, seed, directory):
+            timer = timeit.Timer(run)
+            number, _ = timer.autorange()
+            loops = np.array(timer.repeat(repeat=repeat, number=number))
+            tracemalloc.start()
+            run()
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results.append({
+                'name': name,
+                'params': params,
+                'seconds': float(loops.min() / number),
+                'median_seconds': float(np.median(loops) / number),
+                'peak_bytes': int(peak_bytes),
+            })
+    return results
+
+
+def compare(results, baseline, threshold=0.25):
+    '''
+    Compares results against a baseline run.
+
+    Parameters
+    ----------------------------------
+    results : list of dict
+        from run_benchmarks()
+    baseline : list of dict
+        from an earlier run_benchmarks()
+    threshold : float, default=0.25
+        allowed relative increase before a benchmark counts as a regression
+
+    Returns
+    ----------------------------------
+    regressions : list of dict
+        name, params, metric, baseline and current value of every regression
+    '''
+    previous = {_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(_key(result))
+        if old is None:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            if result[metric] > old[metric] * (1 + threshold):
+                regressions.append({
+                    'name': result['name'],
+                    'params': result['params'],
+                    'metric': metric,
+                    'baseline': old[metric],
+                    'current': result[metric],
+                })
+    return regressions
+
+
+def main(argv=None):
+    '''
+    Command-line entry point. Prints the results as JSON and returns the exit
+    status.
+    '''
+    parser = argparse.ArgumentParser(
+        prog='python -m little_puzzles.benchmark',
+        description='Benchmark solving, generating, validating, reading and '
+                    'displaying triangle puzzles.')
+    parser.add_argument('--rows', type=int, nargs='+', default=list(ROWS),
+                        help='numbers of rows to sweep over')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timing loops per benchmark')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the puzzle fixtures')
+    parser.add_argument('--output', help='also write the results here')
+    parser.add_argument('--baseline', help='results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed relative slowdown, default 0.25')
+    args = parser.parse_args(argv)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'seed': args.seed,
+        },
+        'results': run_benchmarks(args.rows, args.repeat, args.seed),
+    }
+    status = 0
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        report['regressions'] = compare(report['results'], baseline,
+                                        args.threshold)
+        for regression in report['regressions']:
+            print(f"regression: {regression['name']} {regression['params']} "
+                  f"{regression['metric']} {regression['baseline']:.4g} -> "
+                  f"{regression['current']:.4g}", file=sys.stderr)
+        status = 1 if report['regressions'] else 0
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(text + '\n')
+    print(text)
+    return status
+
+
+def _fixture(n_rows, seed=0):
+    '''
+    Returns a solved medium puzzle generated from the seed.
+    '''
+    puzzle = TrianglePuzzle().make_random(n_rows, 'medium',
+                                          random_state=seed)
+    puzzle.solve(method='dp')
+    return puzzle
+
+
+def _key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
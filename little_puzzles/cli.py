@@ -0,0 +1,260 @@
+'''
+The little-puzzles command line.
+
+    little-puzzles generate --rows 6 --level hard --count 10 > puzzles.txt
+    little-puzzles solve puzzles.txt
+    little-puzzles render --spacing 2 < puzzles.txt
+    little-puzzles validate --json puzzles.txt
+
+solve, render and validate read puzzles from the files given, or from
+stdin when there are none or for '-', either in the text layout written by
+TrianglePuzzle.display() or as JSON lines of {"triangle": .., "target": ..}.
+Results are written as each puzzle is done, in the text layout or, with
+--json, as JSON lines. Puzzles of up to _PURE_ROWS rows are solved and
+validated in pure Python, so NumPy is only imported for taller ones and for
+generate.
+'''
+
+import argparse
+import itertools
+import json
+import sys
+from ._pure import (check_rows, count_rows, iter_txt_records, render,
+                    solve_rows)
+
+# puzzles of up to this many rows skip the NumPy solver
+_PURE_ROWS = 20
+
+
+def main(argv=None):
+    '''
+    Command-line entry point. Returns the exit status: 0 when every puzzle
+    was handled, 1 when a puzzle had no solution or was not valid.
+    '''
+    args = _parser().parse_args(argv)
+    out = sys.stdout
+    try:
+        return args.command(args, out)
+    except BrokenPipeError:
+        # The reader went away, as with `little-puzzles solve | head`
+        sys.stderr.close()
+        return 1
+    except ValueError as error:
+        print(f'little-puzzles: {error}', file=sys.stderr)
+        return 2
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='little-puzzles',
+        description='Generate, solve, render and validate triangle puzzles.')
+    commands = parser.add_subparsers(dest='name', required=True)
+
+    generate = commands.add_parser('generate', help='make random puzzles')
+    generate.add_argument('--rows', type=int, default=5,
+                          help='number of rows, default 5')
+    generate.add_argument('--level', choices=('easy', 'medium', 'hard'),
+                          help='value range, default medium')
+    generate.add_argument('--count', type=int, default=1,
+                          help='number of puzzles, default 1')
+    generate.add_argument('--seed', type=int, help='seed of the puzzles')
+    generate.add_argument('--method',
+                          choices=('incremental', 'sample', 'constructive'),
+                          help='passed to TrianglePuzzle.make_random()')
+    generate.add_argument('--workers', type=int, default=1,
+                          help='worker processes, default 1')
+    generate.add_argument('--solution', action='store_true',
+                          help='include the solutions')
+    generate.add_argument('--unique', action='store_true',
+                          help='drop repeated puzzles, so fewer than --count '
+                               'may be written')
+    generate.set_defaults(command=_generate)
+
+    for name, command, text in (
+            ('solve', _solve, 'solve puzzles'),
+            ('render', _render, 'lay puzzles out as text'),
+            ('validate', _validate, 'check that puzzles have one solution')):
+        sub = commands.add_parser(name, help=text)
+        sub.add_argument('files', nargs='*', default=['-'],
+                         help='files to read, stdin when none or -')
+        if name != 'render':
+            sub.add_argument('--engine', choices=('auto', 'pure', 'numpy'),
+                             default='auto',
+                             help=f'auto uses pure Python up to {_PURE_ROWS} '
+                                  'rows and NumPy above')
+        if name == 'render':
+            sub.add_argument('--solution', action='store_true',
+                             help='include the solutions')
+        sub.set_defaults(command=command)
+
+    for sub in commands.choices.values():
+        sub.add_argument('--json', action='store_true',
+                         help='write JSON lines instead of text')
+        sub.add_argument('--spacing', type=int, default=4,
+                         help='spacing between values of a row, default 4')
+        sub.add_argument('--line-spacing', type=int, default=1,
+                         help='spacing between rows, default 1')
+    return parser
+
+
+def _generate(args, out):
+    from .triangle_puzzle import generate_batch
+    show_solution = args.solution or args.json
+    puzzles = generate_batch(args.count, n_rows=args.rows, level=args.level,
+                             seed=args.seed, workers=args.workers,
+                             method=args.method)
+    if args.unique:
+        from .dedupe import dedupe
+        puzzles = dedupe(puzzles, capacity=max(args.count, 1))
+    for puzzle in puzzles:
+        solution = None
+        if show_solution:
+            solution = puzzle.solution_ or puzzle.solve(method='dp')
+        _write(out, args, puzzle.triangle.tolist(), puzzle.target, solution)
+    return 0
+
+
+def _solve(args, out):
+    status = 0
+    for number, (rows, target, _) in enumerate(_read(args.files), 1):
+        try:
+            _check_target(target)
+            solution = _engine(args, rows).solve(rows, target)
+        except ValueError as error:
+            print(f'puzzle {number}: {error}', file=sys.stderr)
+            status = 1
+            solution = None
+        _write(out, args, rows, target, solution)
+    return status
+
+
+def _render(args, out):
+    for rows, target, solution in _read(args.files):
+        _write(out, args, rows, target,
+               solution if args.solution or args.json else None)
+    return 0
+
+
+def _validate(args, out):
+    status = 0
+    for number, (rows, target, _) in enumerate(_read(args.files), 1):
+        try:
+            _check_target(target)
+            n_solutions = _engine(args, rows).count(rows, target)
+        except ValueError as error:
+            print(f'puzzle {number}: {error}', file=sys.stderr)
+            status = 1
+            continue
+        if n_solutions != 1:
+            status = 1
+        if args.json:
+            out.write(json.dumps({'valid': n_solutions == 1,
+                                  'n_solutions': n_solutions}) + '\n')
+        else:
+            verdict = 'valid' if n_solutions == 1 else 'not valid'
+            out.write(f'puzzle {number}: {verdict}, {n_solutions} '
+                      f'solution{"" if n_solutions == 1 else "s"}\n')
+    return status
+
+
+def _check_target(target):
+    if target is None:
+        raise ValueError('Could not find a target value.')
+
+
+class _Pure:
+    solve = staticmethod(solve_rows)
+    count = staticmethod(count_rows)
+
+
+class _NumPy:
+    @staticmethod
+    def solve(rows, target):
+        from .triangle_puzzle import TrianglePuzzle
+        return TrianglePuzzle(rows, target).solve(method='dp')
+
+    @staticmethod
+    def count(rows, target):
+        from .triangle_puzzle import TrianglePuzzle
+        return TrianglePuzzle(rows, target).count_solutions()
+
+
+def _engine(args, rows):
+    if args.engine == 'pure' or (args.engine == 'auto'
+                                 and len(rows) <= _PURE_ROWS):
+        return _Pure
+    return _NumPy
+
+
+def _read(paths):
+    '''
+    Reads the puzzles of every file in turn, '-' being stdin, checking that
+    each triangle has the right shape and positive int values.
+
+    Yields
+    ----------------------------------
+    rows : list of lists of ints
+    target : int
+    solution : str or None
+    '''
+    for path in paths:
+        if path == '-':
+            yield from _read_lines(sys.stdin)
+        else:
+            with open(path, 'r') as lines:
+                yield from _read_lines(lines)
+
+
+def _read_lines(lines):
+    '''
+    Helper function for _read(). Tells JSON lines from the text layout by
+    the first non-blank line.
+    '''
+    lines = iter(lines)
+    for skipped, first in enumerate(lines):
+        if first.strip():
+            break
+    else:
+        return
+    lines = itertools.chain((first,), lines)
+    if not first.lstrip().startswith('{'):
+        for number, (rows, target, solution) in enumerate(
+                iter_txt_records(lines), 1):
+            try:
+                check_rows(rows)
+            except ValueError as error:
+                raise ValueError(f'bad puzzle {number}: {error}') from None
+            yield rows, target, solution
+        return
+    for number, line in enumerate(lines, skipped + 1):
+        if line.strip():
+            yield _json_record(line, number)
+
+
+def _json_record(line, number):
+    '''
+    Helper function for _read_lines(). Parses one JSON line, turning a
+    malformed or incomplete record into a ValueError naming its line.
+    '''
+    try:
+        record = json.loads(line)
+        check_rows(record['triangle'])
+        return (record['triangle'], int(record['target']),
+                record.get('solution'))
+    except KeyError as error:
+        message = f'no {error} key'
+    except (TypeError, ValueError) as error:
+        message = str(error)
+    raise ValueError(f'bad JSON record on line {number}: {message}')
+
+
+def _write(out, args, rows, target, solution):
+    if args.json:
+        record = {'triangle': rows, 'target': target}
+        if solution is not None:
+            record['solution'] = solution
+        out.write(json.dumps(record) + '\n')
+        return
+    render(out.write, rows, target, solution, show_solution=True,
+           spacing=args.spacing, line_spacing=args.line_spacing)
+    out.write('\n')
@@ -0,0 +1,205 @@
+'''
+Streaming deduplication of generated puzzles in bounded memory.
+
+Puzzles are compared by fingerprint (see TrianglePuzzle.fingerprint()). A
+Bloom filter sized for the expected number of puzzles answers "never seen"
+for almost every new puzzle without touching anything else. Only when it
+answers "maybe seen" is the fingerprint looked up in an exact store, a
+SQLite table on disk that receives every new fingerprint in batches. Memory
+is the filter plus one batch, whatever the number of puzzles:
+
+    with PuzzleDeduplicator(capacity=10_000_000) as seen:
+        for puzzle in seen.filter(generate_batch(10_000_000, n_rows=8)):
+            ...
+
+A full filter only answers "maybe seen" more often, so overfilling it costs
+lookups, never correctness.
+'''
+
+import math
+import os
+import sqlite3
+import tempfile
+
+
+class BloomFilter:
+    '''
+    Bloom filter over 16-byte fingerprints. The k bit positions of a
+    fingerprint are derived from its two 8-byte halves by double hashing.
+
+    Parameters
+    ----------------------------------
+    capacity : int
+        number of fingerprints the filter is sized for
+    error_rate : float, default=0.001
+        rate of false "maybe seen" answers once capacity fingerprints are in
+
+    Attributes
+    ----------------------------------
+    n_bits : int
+    n_hashes : int
+    '''
+
+    __slots__ = ('n_bits', 'n_hashes', '_bits')
+
+    def __init__(self, capacity, error_rate=0.001):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1.')
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be between 0 and 1.')
+        self.n_bits = max(8, math.ceil(-capacity * math.log(error_rate)
+                                       / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.n_bits + 7) // 8)
+
+    def add(self, fingerprint):
+        '''
+        Adds a fingerprint.
+
+        Returns
+        ----------------------------------
+        maybe_seen : bool
+            False when the fingerprint was certainly not added before
+        '''
+        bits = self._bits
+        first = int.from_bytes(fingerprint[:8], 'little')
+        step = int.from_bytes(fingerprint[8:16], 'little') | 1
+        maybe_seen = True
+        for i in range(self.n_hashes):
+            bit = (first + i * step) % self.n_bits
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not bits[byte] & mask:
+                maybe_seen = False
+                bits[byte] |= mask
+        return maybe_seen
+
+    @property
+    def nbytes(self):
+        return len(self._bits)
+
+
+class PuzzleDeduplicator:
+    '''
+    Remembers the puzzles it has seen, in a Bloom filter backed by an exact
+    SQLite store. Use it as a context manager or call close() when done.
+
+    Parameters
+    ----------------------------------
+    capacity : int, default=10_000_000
+        number of puzzles the Bloom filter is sized for
+    error_rate : float, default=0.001
+        Bloom filter false positive rate at capacity, each false positive
+        costs one lookup in the store
+    path : str, default=None
+        SQLite file of the exact store, None uses a temporary file removed
+        on close(). An existing file carries the puzzles seen by an earlier
+        run over, though only the store knows them until they come again.
+    key : str, default='puzzle'
+        'puzzle' drops repeated (triangle, target) pairs, 'triangle' drops
+        repeated triangles whatever their target
+    batch_size : int, default=10000
+        new fingerprints held in memory before they are written to the store
+
+    Attributes
+    ----------------------------------
+    n_seen : int
+        puzzles checked
+    n_duplicates : int
+        puzzles found to be duplicates
+    n_lookups : int
+        puzzles the Bloom filter could not clear and the store was asked
+        about
+    '''
+
+    def __init__(self, capacity=10_000_000, error_rate=0.001, path=None,
+                 key='puzzle', batch_size=10000):
+        if key not in ('puzzle', 'triangle'):
+            raise ValueError('Options for key are \'puzzle\' or \'triangle\'.')
+        self.key = key
+        self.batch_size = batch_size
+        self.n_seen = 0
+        self.n_duplicates = 0
+        self.n_lookups = 0
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._pending = set()
+        self._temporary = None
+        if path is None:
+            handle, path = tempfile.mkstemp(suffix='.sqlite')
+            os.close(handle)
+            self._temporary = path
+        self.path = path
+        self._store = sqlite3.connect(path)
+        self._store.execute('PRAGMA journal_mode=OFF')
+        self._store.execute('PRAGMA synchronous=OFF')
+        self._store.execute('CREATE TABLE IF NOT EXISTS fingerprints '
+                            '(fingerprint BLOB PRIMARY KEY) WITHOUT ROWID')
+        self._known = self._store.execute(
+            'SELECT EXISTS(SELECT 1 FROM fingerprints)').fetchone()[0]
+
+    def add(self, puzzle):
+        '''
+        Records a puzzle.
+
+        Returns
+        ----------------------------------
+        new : bool
+            True the first time a puzzle is seen
+        '''
+        fingerprint = puzzle.fingerprint(include_target=self.key == 'puzzle')
+        self.n_seen += 1
+        if self._bloom.add(fingerprint) or self._known:
+            self.n_lookups += 1
+            if fingerprint in self._pending or self._stored(fingerprint):
+                self.n_duplicates += 1
+                return False
+        self._pending.add(fingerprint)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        return True
+
+    def filter(self, puzzles):
+        '''
+        Yields the puzzles not seen before, in order.
+        '''
+        for puzzle in puzzles:
+            if self.add(puzzle):
+                yield puzzle
+
+    def flush(self):
+        '''
+        Writes the pending fingerprints to the store.
+        '''
+        if self._pending:
+            with self._store:
+                self._store.executemany(
+                    'INSERT OR IGNORE INTO fingerprints VALUES (?)',
+                    ((fingerprint,) for fingerprint in self._pending))
+            self._pending.clear()
+
+    def close(self):
+        if self._temporary is None:
+            self.flush()
+        self._store.close()
+        if self._temporary is not None:
+            os.remove(self._temporary)
+            self._temporary = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _stored(self, fingerprint):
+        return self._store.execute(
+            'SELECT 1 FROM fingerprints WHERE fingerprint = ?',
+            (fingerprint,)).fetchone() is not None
+
+
+def dedupe(puzzles, **kwargs):
+    '''
+    Yields the puzzles not seen before, in order. Keyword arguments are
+    passed to PuzzleDeduplicator.
+    '''
+    with PuzzleDeduplicator(**kwargs) as seen:
+        yield from seen.filter(puzzles)
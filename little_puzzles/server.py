@@ -0,0 +1,552 @@
+'''
+A local puzzle service: generates, solves and validates triangle puzzles
+over HTTP on a TCP port or a Unix socket, so that callers do not pay for
+starting Python and importing NumPy on every request.
+
+Every endpoint takes and returns JSON:
+
+    POST /generate  {"n_rows": 5, "level": "medium", "count": 1,
+                     "method": null}
+        -> {"puzzles": [{"triangle": [[...]], "target": ..,
+                         "solution": ".."}]}
+    POST /solve     {"triangle": [[...]], "target": .., "method": "dp"}
+        -> {"solution": ".."}
+    POST /validate  {"triangle": [[...]], "target": ..}
+        -> {"valid": true, "n_solutions": 1}
+           or 422 {"valid": false, "error": ..} when counting would take
+           more than max_states remaining targets in one row
+    GET  /health    -> {"status": "ok", "pending": .., "pools": {..}}
+
+The work runs in a process pool started with the server. Concurrent solve
+and validate requests are coalesced into batches handed to the pool in one
+go. At most max_pending requests of any kind wait at a time and the rest
+are answered 503 right away. Generated puzzles are served from a pool kept
+for every (n_rows, level, method) asked for and refilled in the background.
+The 'incremental' and 'sample' generators count the paths to every product,
+so they are only offered up to _ENUMERATION_ROWS rows.
+
+Run it from the command line:
+
+    python -m little_puzzles.server --port 8000
+    python -m little_puzzles.server --unix /tmp/little-puzzles.sock
+'''
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import json
+import os
+import sys
+from collections import deque
+import numpy as np
+from .triangle_puzzle import (TrianglePuzzle, _ENUMERATION_ROWS,
+                              _count_paths_mitm)
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 413: 'Payload Too Large',
+            422: 'Unprocessable Entity', 503: 'Service Unavailable'}
+
+
+class PuzzleServer:
+    '''
+    Asyncio puzzle service backed by a warm process pool.
+
+    Parameters
+    ----------------------------------
+    workers : int, default=None
+        number of worker processes, None uses every core
+    batch_size : int, default=64
+        most solve or validate requests handed to the pool at once
+    batch_delay : float, default=0.002
+        seconds a batch waits for more requests before it is handed over
+    max_pending : int, default=1024
+        most requests waiting at a time
+    pool_size : int, default=32
+        puzzles kept ready for every (n_rows, level, method) asked for
+    max_rows : int, default=60
+        most rows of a puzzle generated, solved or validated,
+        _ENUMERATION_ROWS at most for the 'incremental' and 'sample'
+        generators
+    max_states : int, default=1 << 20
+        most remaining targets one row of a validation may hold (see
+        _count_paths_mitm()), which bounds its time and memory
+    max_count : int, default=256
+        most puzzles generated by one request
+    max_body : int, default=1 << 20
+        most bytes in a request body
+    seed : None, int or numpy.random.SeedSequence
+        root of the random streams of the generated puzzles
+    '''
+
+    def __init__(self, workers=None, batch_size=64, batch_delay=0.002,
+                 max_pending=1024, pool_size=32, max_rows=60, max_count=256,
+                 max_body=1 << 20, max_states=1 << 20, seed=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_pending = max_pending
+        self.pool_size = pool_size
+        self.max_rows = max_rows
+        self.max_count = max_count
+        self.max_body = max_body
+        self.max_states = max_states
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self._seed = seed
+        self._executor = None
+        self._server = None
+        self._queues = {}
+        self._tasks = []
+        self._running = set()
+        self._pending = 0
+        self._pools = {}
+        self._refilling = {}
+
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        '''
+        Starts the process pool and listens on the Unix socket at path, or on
+        host and port when path is None (port 0 picks a free port).
+
+        Returns self
+        '''
+        loop = asyncio.get_running_loop()
+        self._executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+        # Start every worker now so that no request waits for one to start
+        await asyncio.gather(*(loop.run_in_executor(self._executor, _warm)
+                               for _ in range(self.workers)))
+        for kind, run in (('solve', _solve_batch),
+                          ('validate', _validate_batch)):
+            queue = asyncio.Queue()
+            self._queues[kind] = queue
+            self._tasks.append(asyncio.create_task(self._batch(queue, run)))
+        # A burst of connections should queue up rather than be dropped
+        backlog = max(self.max_pending, 128)
+        if path is not None:
+            self._server = await asyncio.start_unix_server(
+                self._handle, path=path, limit=self.max_body,
+                backlog=backlog)
+        else:
+            self._server = await asyncio.start_server(
+                self._handle, host=host, port=port, limit=self.max_body,
+                backlog=backlog)
+        return self
+
+    @property
+    def address(self):
+        '''
+        (host, port) or the socket path the server listens on.
+        '''
+        return self._server.sockets[0].getsockname()
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        '''
+        Stops listening, cancels the batching and refilling tasks and shuts
+        the process pool down.
+        '''
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        tasks = (self._tasks + list(self._running)
+                 + list(self._refilling.values()))
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def generate(self, n_rows=5, level=None, count=1, method=None):
+        '''
+        Takes count puzzles from the pool of (n_rows, level, method),
+        generating whatever the pool cannot cover, and tops the pool up in
+        the background.
+
+        Returns
+        ----------------------------------
+        puzzles : list of dict
+            triangle, target and solution of each puzzle
+        '''
+        key = (n_rows, level, method)
+        pool = self._pools.setdefault(key, deque())
+        with self._admit():
+            puzzles = [pool.popleft() for _ in range(min(count, len(pool)))]
+            if len(puzzles) < count:
+                puzzles += await self._generate(key, count - len(puzzles))
+        self._refill(key)
+        return puzzles
+
+    async def solve(self, triangle, target, method='dp'):
+        '''
+        Solves one puzzle in the next batch.
+
+        Returns
+        ----------------------------------
+        result : dict
+            solution, or error when the puzzle has no solution
+        '''
+        return await self._submit('solve', (triangle, target, method))
+
+    async def validate(self, triangle, target):
+        '''
+        Counts the solutions of one puzzle in the next batch.
+
+        Returns
+        ----------------------------------
+        result : dict
+            valid (exactly one solution) and n_solutions, or error when the
+            puzzle is malformed or too large to count within max_states
+        '''
+        return await self._submit('validate',
+                                  (triangle, target, self.max_states))
+
+    def pending(self):
+        '''
+        Number of requests waiting or being worked on.
+        '''
+        return self._pending
+
+    @contextlib.contextmanager
+    def _admit(self):
+        '''
+        Counts one request as pending while it is worked on, raising _Busy
+        when max_pending requests already are.
+        '''
+        if self._pending >= self.max_pending:
+            raise _Busy()
+        self._pending += 1
+        try:
+            yield
+        finally:
+            self._pending -= 1
+
+    async def _submit(self, kind, payload):
+        with self._admit():
+            future = asyncio.get_running_loop().create_future()
+            self._queues[kind].put_nowait((payload, future))
+            return await future
+
+    async def _batch(self, queue, run):
+        '''
+        Hands the requests of queue to the process pool in batches of up to
+        self.batch_size, waiting up to self.batch_delay for a batch to fill.
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                if not queue.empty():
+                    batch.append(queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(),
+                                                        timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Gather the next batch while the pool runs this one
+            task = asyncio.create_task(self._run(run, batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, run, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                self._executor, run, [payload for payload, _ in batch])
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _generate(self, key, count):
+        '''
+        Generates count puzzles in the process pool, split across the
+        workers.
+        '''
+        loop = asyncio.get_running_loop()
+        n_rows, level, method = key
+        shares = [count // self.workers + (i < count % self.workers)
+                  for i in range(self.workers)]
+        seeds = self._seed.spawn(len(shares))
+        batches = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, _generate_batch, n_rows,
+                                 level, method, seed, share)
+            for seed, share in zip(seeds, shares) if share))
+        return [puzzle for batch in batches for puzzle in batch]
+
+    def _refill(self, key):
+        '''
+        Starts topping the pool of key up to self.pool_size in the
+        background once it is half empty, unless it already is being.
+        '''
+        pool = self._pools[key]
+        if key in self._refilling or len(pool) > self.pool_size // 2:
+            return
+
+        async def refill():
+            try:
+                pool.extend(await self._generate(
+                    key, self.pool_size - len(pool)))
+            finally:
+                del self._refilling[key]
+
+        self._refilling[key] = asyncio.create_task(refill())
+
+    async def _handle(self, reader, writer):
+        '''
+        Serves the HTTP/1.1 requests of one connection.
+        '''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await _respond(writer, 400,
+                                   {'error': 'Invalid Content-Length.'})
+                    break
+                if length > self.max_body:
+                    await _respond(writer, 413,
+                                   {'error': 'Request body too large.'})
+                    break
+                body = await reader.readexactly(length)
+                try:
+                    http_method, target, _ = (request_line.decode('latin-1')
+                                              .split())
+                except ValueError:
+                    await _respond(writer, 400,
+                                   {'error': 'Malformed request line.'})
+                    break
+                status, response = await self._dispatch(http_method, target,
+                                                        body)
+                await _respond(writer, status, response)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, http_method, target, body):
+        '''
+        Routes one request.
+
+        Returns
+        ----------------------------------
+        status : int
+        response : dict
+        '''
+        if target == '/health':
+            return 200, {'status': 'ok', 'pending': self.pending(),
+                         'pools': {json.dumps(key): len(pool)
+                                   for key, pool in self._pools.items()}}
+        routes = {'/generate': self._post_generate,
+                  '/solve': self._post_solve,
+                  '/validate': self._post_validate}
+        if target not in routes:
+            return 404, {'error': f'No endpoint {target}.'}
+        if http_method != 'POST':
+            return 405, {'error': f'{target} only accepts POST.'}
+        try:
+            request = json.loads(body or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError('The request must be a JSON object.')
+            response = await routes[target](request)
+        except _Busy:
+            return 503, {'error': 'Too many pending requests.'}
+        except (ValueError, TypeError, KeyError) as error:
+            return 400, {'error': str(error)}
+        except Exception as error:
+            return 400, {'error': f'{type(error).__name__}: {error}'}
+        return (422 if 'error' in response else 200), response
+
+    async def _post_generate(self, request):
+        n_rows = int(request.get('n_rows', 5))
+        level = request.get('level')
+        method = request.get('method')
+        count = int(request.get('count', 1))
+        max_rows = self.max_rows
+        if method in ('incremental', 'sample'):
+            max_rows = min(max_rows, _ENUMERATION_ROWS)
+        if not 1 <= n_rows <= max_rows:
+            raise ValueError(f'n_rows must be between 1 and {max_rows}'
+                             + (f' for method {method!r}.' if method else '.'))
+        if not 1 <= count <= self.max_count:
+            raise ValueError(f'count must be between 1 and {self.max_count}.')
+        if level not in (None, 'easy', 'medium', 'hard'):
+            raise ValueError(
+                'Options for level are \'easy\', \'medium\', or \'hard\'.')
+        if method not in (None, 'incremental', 'sample', 'constructive'):
+            raise ValueError(
+                'Options for method are \'incremental\', \'sample\', or '
+                '\'constructive\'.')
+        return {'puzzles': await self.generate(n_rows, level, count, method)}
+
+    async def _post_solve(self, request):
+        return await self.solve(self._triangle(request),
+                                int(request['target']),
+                                request.get('method', 'dp'))
+
+    async def _post_validate(self, request):
+        return await self.validate(self._triangle(request),
+                                   int(request['target']))
+
+    def _triangle(self, request):
+        triangle = request['triangle']
+        if not isinstance(triangle, list):
+            raise ValueError('The triangle must be a list of rows.')
+        if not 1 <= len(triangle) <= self.max_rows:
+            raise ValueError(
+                f'The triangle must have between 1 and {self.max_rows} rows.')
+        return triangle
+
+
+class _Busy(Exception):
+    '''
+    Raised when a request arrives while max_pending requests are waiting.
+    '''
+
+
+async def _respond(writer, status, response):
+    body = json.dumps(response).encode()
+    writer.write(
+        f'HTTP/1.1 {status} {_REASONS[status]}\r\n'
+        f'Content-Type: application/json\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        f'\r\n'.encode('latin-1') + body)
+    await writer.drain()
+
+
+def _warm():
+    '''
+    Helper function for PuzzleServer.start(). Runs in each worker so that it
+    is started, with NumPy imported, before the first request.
+    '''
+    return os.getpid()
+
+
+def _puzzle_dict(puzzle):
+    return {'triangle': puzzle.triangle.tolist(),
+            'target': int(puzzle.target),
+            'solution': puzzle.solution_}
+
+
+def _generate_batch(n_rows, level, method, seed, count):
+    '''
+    Helper function for PuzzleServer. Generates and solves count puzzles in
+    a worker.
+    '''
+    rng = np.random.default_rng(seed)
+    puzzles = []
+    for _ in range(count):
+        puzzle = TrianglePuzzle().make_random(n_rows, level, random_state=rng,
+                                              method=method)
+        if puzzle.solution_ is None:
+            puzzle.solve(method='dp')
+        puzzles.append(_puzzle_dict(puzzle))
+    return puzzles
+
+
+def _solve_batch(payloads):
+    '''
+    Helper function for PuzzleServer. Solves a batch of puzzles in a worker.
+    '''
+    results = []
+    for triangle, target, method in payloads:
+        # anything one puzzle raises is its own answer, never the batch's
+        try:
+            solution = TrianglePuzzle(triangle, target).solve(method=method)
+        except Exception as error:
+            results.append({'solution': None, 'error': str(error)})
+        else:
+            results.append({'solution': solution})
+    return results
+
+
+def _validate_batch(payloads):
+    '''
+    Helper function for PuzzleServer. Counts the solutions of a batch of
+    puzzles in a worker.
+    '''
+    results = []
+    for triangle, target, max_states in payloads:
+        try:
+            puzzle = TrianglePuzzle(triangle, target)
+            n_solutions = _count_paths_mitm(puzzle.triangle, target,
+                                            max_states=max_states)
+        except Exception as error:
+            results.append({'valid': False, 'error': str(error)})
+            continue
+        if n_solutions is None:
+            results.append({'valid': False,
+                            'error': 'The puzzle is too large to validate.'})
+        else:
+            results.append({'valid': n_solutions == 1,
+                            'n_solutions': n_solutions})
+    return results
+
+
+def main(argv=None):
+    '''
+    Command-line entry point. Serves until interrupted.
+    '''
+    parser = argparse.ArgumentParser(
+        prog='python -m little_puzzles.server',
+        description='Serve triangle puzzle generation, solving and '
+                    'validation over local HTTP.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on, default 127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='port to listen on, default 8000')
+    parser.add_argument('--unix', help='listen on this Unix socket instead')
+    parser.add_argument('--workers', type=int, help='worker processes')
+    parser.add_argument('--pool-size', type=int, default=32,
+                        help='puzzles kept ready per kind, default 32')
+    parser.add_argument('--max-pending', type=int, default=1024,
+                        help='requests allowed to wait, default 1024')
+    parser.add_argument('--seed', type=int, help='seed of the puzzles')
+    args = parser.parse_args(argv)
+
+    async def serve():
+        server = PuzzleServer(workers=args.workers, pool_size=args.pool_size,
+                              max_pending=args.max_pending, seed=args.seed)
+        async with await server.start(args.host, args.port, args.unix):
+            print(f'Serving on {server.address}', file=sys.stderr)
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,444 @@
 '''Tests the puzzle generators and solvers.
 '''
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
 import unittest
+from . import _pure
+from . import benchmark
+from . import cli
+from . import dedupe
+from . import server
+from . import triangle_archive
 from . import triangle_puzzle
 
 
 class TrianglePuzzleTest(unittest.TestCase):
-    pass
+
+    def setUp(self):
+        self.triangle = [[2], [3, 4], [5, 6, 7], [1, 2, 3, 4]]
+        self.target = 2 * 4 * 6 * 3
+
+    def test_solve_methods_agree(self):
+        for method in ('dfs', 'dp'):
+            puzzle = triangle_puzzle.TrianglePuzzle(self.triangle,
+                                                    self.target)
+            self.assertEqual(puzzle.solve(method=method), 'RLR')
+            self.assertEqual(puzzle.solution_, 'RLR')
+
+    def test_solve_dp_no_solution(self):
+        puzzle = triangle_puzzle.TrianglePuzzle(self.triangle, 11)
+        with self.assertRaises(ValueError):
+            puzzle.solve(method='dp')
+
+    def test_is_valid_puzzle_targets(self):
+        puzzle = triangle_puzzle.TrianglePuzzle([[2], [3, 3], [5, 6, 7]])
+        valid, targets = puzzle._is_valid_puzzle()
+        # 2 * 3 * 6 is reached both by 'LR' and by 'RL'
+        self.assertTrue(valid)
+        self.assertEqual(sorted(targets), [30, 42])
+        puzzle.set_target(36)
+        self.assertEqual(puzzle._is_valid_puzzle(), (False, None))
+
+    def test_count_paths_mitm(self):
+        triangle = [[2], [3, 3], [5, 6, 7], [1, 2, 3, 4]]
+        self.assertEqual(triangle_puzzle._count_paths_mitm(triangle, 72), 2)
+        self.assertEqual(triangle_puzzle._count_paths_mitm(triangle, 30), 1)
+        self.assertEqual(triangle_puzzle._count_paths_mitm(triangle, 11), 0)
+
+    def test_make_random_beyond_enumeration(self):
+        n_rows = triangle_puzzle._ENUMERATION_ROWS + 4
+        puzzle = triangle_puzzle.TrianglePuzzle().make_random(n_rows)
+        self.assertEqual(len(puzzle.triangle), n_rows)
+        self.assertEqual(puzzle._is_valid_puzzle(), (True, puzzle.target))
+        self.assertEqual(len(puzzle.solve(method='dp')), n_rows - 1)
+
+    def test_solve_many(self):
+        puzzles = [triangle_puzzle.TrianglePuzzle(self.triangle, target)
+                   for target in (self.target, 11, 2 * 3 * 5 * 1, None)]
+        puzzles.append(triangle_puzzle.TrianglePuzzle())
+        for workers in (1, 2):
+            results = triangle_puzzle.solve_many(puzzles, workers=workers,
+                                                 chunksize=1)
+            self.assertEqual([r.solution for r in results],
+                             ['RLR', None, 'LLL', None, None])
+            self.assertIsNotNone(results[1].error)
+            self.assertIsNotNone(results[3].error)
+            self.assertIsNotNone(results[4].error)
+
+    def test_generate_batch_reproducible(self):
+        def snapshot(workers):
+            return [(int(p.target), [list(map(int, row)) for row in p.triangle])
+                    for p in triangle_puzzle.generate_batch(
+                        12, n_rows=6, seed=7, workers=workers, chunksize=2)]
+
+        self.assertEqual(snapshot(1), snapshot(2))
+
+    def test_triangle_storage(self):
+        triangle = triangle_puzzle.Triangle.from_rows(self.triangle)
+        self.assertEqual(len(triangle), 4)
+        self.assertEqual(triangle[2, 1], 6)
+        self.assertEqual(list(triangle[3]), [1, 2, 3, 4])
+        self.assertEqual(triangle.tolist(), self.triangle)
+        puzzle = triangle_puzzle.TrianglePuzzle(self.triangle, self.target)
+        self.assertEqual(puzzle.triangle, triangle)
+        for rows in ([[2 ** 63]], [[2], [3, 2 ** 64]]):
+            with self.assertRaises(ValueError):
+                triangle_puzzle.Triangle.from_rows(rows)
+
+    def test_triangle_validation(self):
+        for rows in ([[1], [2]], [[1], [0, 2]], [[1], ['a', 2]]):
+            with self.assertRaises(ValueError):
+                triangle_puzzle.TrianglePuzzle().set_triangle(rows)
+
+    def test_prime_exponents(self):
+        triangle = triangle_puzzle.Triangle.from_rows([[4], [3, 5], [9, 2, 1]])
+        arithmetic = triangle_puzzle._PrimeExponents(4 * 3 * 9, triangle)
+        remaining = arithmetic.target
+        for cell in (0, 1, 3):
+            remaining = arithmetic.divide(remaining, cell)
+        self.assertEqual(remaining, arithmetic.one)
+        self.assertIsNone(arithmetic.divide(arithmetic.target, 2))
+        self.assertIsNone(arithmetic.divide(remaining, 4))
+        self.assertIsNone(
+            triangle_puzzle._PrimeExponents(4 * 7, triangle).target)
+
+    def test_solve_huge_target(self):
+        triangle = [[2 ** 40]] + [[3 ** 30] * (row + 1) for row in range(1, 6)]
+        target = 2 ** 40 * 3 ** 150
+        for method in ('dfs', 'dp'):
+            puzzle = triangle_puzzle.TrianglePuzzle(triangle, target)
+            self.assertEqual(puzzle.solve(method=method), 'LLLLL')
+
+    def test_txt_round_trip(self):
+        puzzles = [triangle_puzzle.TrianglePuzzle(self.triangle, self.target),
+                   triangle_puzzle.TrianglePuzzle([[7], [2, 3]]),
+                   triangle_puzzle.TrianglePuzzle([[7], [2, 3]], 21)]
+        puzzles[0].solve()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'puzzles.txt')
+            triangle_puzzle.write_txt_puzzles(puzzles[:1], path,
+                                              show_solution=True)
+            with triangle_puzzle.PuzzleTxtWriter(path,
+                                                 line_spacing=2) as writer:
+                writer.write_many(puzzles[1:])
+            read = list(triangle_puzzle.iter_txt_puzzles(path))
+        self.assertEqual([p.target for p in read], [self.target, None, 21])
+        self.assertEqual(read[0].triangle.tolist(), self.triangle)
+        self.assertEqual(read[1].triangle.tolist(), [[7], [2, 3]])
+        self.assertEqual(read[0].solution_, 'RLR')
+        self.assertIsNone(read[2].solution_)
+
+    def test_archive_random_access(self):
+        puzzles = [triangle_puzzle.TrianglePuzzle(self.triangle, self.target),
+                   triangle_puzzle.TrianglePuzzle([[300]], 2 ** 70),
+                   triangle_puzzle.TrianglePuzzle([[7], [2, 3]])]
+        puzzles[0].solve()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'puzzles.lpa')
+            triangle_archive.write_archive(puzzles[:2], path)
+            triangle_archive.write_archive(puzzles[2:], path)
+            with triangle_archive.open_archive(path) as archive:
+                self.assertEqual(len(archive), 3)
+                read = [archive[2], archive[0], archive[1]]
+        self.assertEqual(read[0].triangle.tolist(), [[7], [2, 3]])
+        self.assertIsNone(read[0].target)
+        self.assertEqual(read[1].triangle.tolist(), self.triangle)
+        self.assertEqual(read[1].solution_, 'RLR')
+        self.assertEqual(read[2].target, 2 ** 70)
+
+        # 8-byte values are read without a copy
+        big = triangle_puzzle.TrianglePuzzle([[1 << 40], [2, 3]], 1 << 41)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'big.lpa')
+            triangle_archive.write_archive([big], path)
+            with triangle_archive.open_archive(path) as archive:
+                values = archive[0].triangle.values
+                self.assertFalse(values.flags.owndata)
+                self.assertEqual(values.tolist(), [1 << 40, 2, 3])
+
+    def test_display_stream_and_quiet(self):
+        puzzle = triangle_puzzle.TrianglePuzzle([[7], [2, 13]], 91)
+        puzzle.solve()
+        expected = ('Target: 91\n'
+                    '    7\n'
+                    '2       13\n'
+                    'Solution: R\n')
+        stream = io.StringIO()
+        self.assertEqual(puzzle.display(show_solution=True, stream=stream),
+                         expected)
+        self.assertEqual(stream.getvalue(), expected)
+        self.assertEqual(puzzle.display(quiet=True), expected[:-12])
+
+    def test_benchmark_compare(self):
+        baseline = [{'name': 'solve', 'params': {'n_rows': 8},
+                     'seconds': 1.0, 'peak_bytes': 100}]
+        results = [{'name': 'solve', 'params': {'n_rows': 8},
+                    'seconds': 1.5, 'peak_bytes': 110}]
+        regressions = benchmark.compare(results, baseline, threshold=0.25)
+        self.assertEqual([r['metric'] for r in regressions], ['seconds'])
+        self.assertEqual(benchmark.compare(results, baseline, threshold=1),
+                         [])
+
+    def test_solve_stats(self):
+        puzzle = triangle_puzzle.TrianglePuzzle(self.triangle, self.target)
+        puzzle.solve()
+        self.assertIsNone(puzzle.stats_)
+        for method in ('dfs', 'dp'):
+            events = []
+            puzzle.solve(method, callback=lambda *event:
+                         events.append(event))
+            self.assertEqual(puzzle.solution_, 'RLR')
+            self.assertGreater(puzzle.stats_.nodes_expanded, 0)
+            self.assertEqual(events[-1], ('solution', None, None))
+            self.assertEqual(len(events),
+                             sum(puzzle.stats_.counts.values()))
+
+    def test_make_random_methods(self):
+        for method in ('incremental', 'sample', 'constructive'):
+            puzzle = triangle_puzzle.TrianglePuzzle().make_random(
+                8, 'easy', random_state=0, method=method)
+            self.assertEqual(len(puzzle.triangle), 8)
+            self.assertEqual(puzzle._is_valid_puzzle(),
+                             (True, puzzle.target))
+        with self.assertRaises(ValueError):
+            triangle_puzzle.TrianglePuzzle().make_random(method='greedy')
+
+    def test_make_random_constructive(self):
+        for seed in range(20):
+            puzzle = triangle_puzzle.TrianglePuzzle().make_random(
+                6, 'easy', random_state=seed, method='constructive')
+            solution = puzzle.solution_
+            self.assertEqual(puzzle._is_valid_puzzle(),
+                             (True, puzzle.target))
+            self.assertEqual(puzzle.solve(method='dp'), solution)
+
+    def test_make_random_tall(self):
+        # tall triangles default to the constructive generator, which draws
+        # one triangle and no candidates however many rows there are
+        puzzle = triangle_puzzle.TrianglePuzzle().make_random(
+            40, 'easy', random_state=0, stats=True)
+        self.assertEqual(puzzle.stats_.counts['triangle'], 1)
+        self.assertEqual(puzzle.stats_.counts['candidate'], 0)
+        self.assertIsNotNone(puzzle.solution_)
+        # a capped count gives up instead of growing without bound
+        self.assertIsNone(triangle_puzzle._count_paths_mitm(
+            puzzle.triangle, puzzle.target, max_states=16))
+
+    def test_iter_and_count_solutions(self):
+        puzzle = triangle_puzzle.TrianglePuzzle([[2], [3, 3], [5, 6, 7]],
+                                                2 * 3 * 6)
+        solutions = puzzle.iter_solutions()
+        self.assertEqual(next(solutions), 'LR')
+        self.assertEqual(list(solutions), ['RL'])
+        self.assertEqual(puzzle.count_solutions(), 2)
+        self.assertEqual(puzzle.count_solutions(2 * 3 * 5), 1)
+        self.assertEqual(puzzle.count_solutions(11), 0)
+
+    def test_product_index(self):
+        puzzle = triangle_puzzle.TrianglePuzzle([[2], [3, 3], [5, 6, 7]])
+        index = puzzle.product_index()
+        self.assertIs(puzzle.product_index(), index)
+        self.assertEqual(sorted(index.unique_targets()), [30, 42])
+        self.assertEqual(index.paths(30), ['LL'])
+        self.assertEqual(sorted(index.paths(36)), ['LR', 'RL'])
+        self.assertNotIn(11, index)
+        puzzle.set_triangle(self.triangle)
+        self.assertIsNot(puzzle.product_index(), index)
+        self.assertEqual(puzzle.product_index().paths(self.target), ['RLR'])
+
+        tall = triangle_puzzle.ProductIndex(self.triangle, max_rows=2,
+                                            cache_size=1)
+        self.assertEqual(tall.paths(self.target), ['RLR'])
+        self.assertEqual(tall.count(2 * 3 * 5 * 1), 1)
+        self.assertEqual(len(tall), 1)
+        with self.assertRaises(ValueError):
+            tall.unique_targets()
+
+    def test_server(self):
+        async def post(address, path, request):
+            reader, writer = await asyncio.open_connection(*address[:2])
+            body = json.dumps(request).encode()
+            writer.write(f'POST {path} HTTP/1.1\r\nConnection: close\r\n'
+                         f'Content-Length: {len(body)}\r\n\r\n'.encode()
+                         + body)
+            status = int((await reader.readline()).split()[1])
+            response = (await reader.read()).split(b'\r\n\r\n', 1)[1]
+            writer.close()
+            return status, json.loads(response)
+
+        async def run():
+            puzzle_server = server.PuzzleServer(workers=1, pool_size=4,
+                                                seed=0)
+            async with await puzzle_server.start() as running:
+                address = running.address
+                status, response = await post(address, '/generate',
+                                              {'n_rows': 5, 'count': 2})
+                self.assertEqual(status, 200)
+                self.assertEqual(len(response['puzzles']), 2)
+                solved = await asyncio.gather(*(
+                    post(address, '/solve', {'triangle': self.triangle,
+                                             'target': self.target})
+                    for _ in range(8)))
+                self.assertEqual(solved, [(200, {'solution': 'RLR'})] * 8)
+                status, response = await post(
+                    address, '/validate',
+                    {'triangle': self.triangle, 'target': 11})
+                self.assertEqual((status, response['valid']), (200, False))
+                status, _ = await post(address, '/solve',
+                                       {'triangle': self.triangle,
+                                        'target': 11})
+                self.assertEqual(status, 422)
+                status, _ = await post(address, '/generate',
+                                       {'n_rows': 30,
+                                        'method': 'incremental'})
+                self.assertEqual(status, 400)
+                reader, writer = await asyncio.open_connection(*address[:2])
+                writer.write(b'POST /solve HTTP/1.1\r\n'
+                             b'Content-Length: abc\r\n\r\n')
+                self.assertIn(b' 400 ', await reader.readline())
+                writer.close()
+                # a puzzle that fails does not fail the rest of its batch
+                solved = await asyncio.gather(
+                    post(address, '/solve', {'triangle': self.triangle,
+                                             'target': self.target}),
+                    post(address, '/solve', {'triangle': [[2 ** 64]],
+                                             'target': 2 ** 64}))
+                self.assertEqual([status for status, _ in solved], [200, 422])
+                status, _ = await post(address, '/validate',
+                                       {'triangle': [[2]] * 61, 'target': 2})
+                self.assertEqual(status, 400)
+                running.max_states = 1
+                status, response = await post(
+                    address, '/validate',
+                    {'triangle': self.triangle, 'target': self.target})
+                self.assertEqual((status, response['valid']), (422, False))
+
+        asyncio.run(run())
+        # generate requests count towards max_pending too
+        with self.assertRaises(server._Busy):
+            asyncio.run(server.PuzzleServer(max_pending=0).generate())
+
+    def test_cli(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'puzzles.txt')
+            triangle_puzzle.TrianglePuzzle(
+                self.triangle, self.target).puzzle_to_txt(path)
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                status = cli.main(['solve', '--json', path])
+            self.assertEqual(status, 0)
+            self.assertEqual(json.loads(out.getvalue())['solution'], 'RLR')
+
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                status = cli.main(['validate', '--engine', 'numpy', path])
+            self.assertEqual(status, 0)
+            self.assertIn('valid, 1 solution', out.getvalue())
+
+            with open(path, 'w') as records:
+                records.write('{"triangle": [[2]]}\n')
+            err = io.StringIO()
+            with contextlib.redirect_stderr(err):
+                status = cli.main(['solve', path])
+            self.assertEqual(status, 2)
+            self.assertIn("line 1: no 'target' key", err.getvalue())
+
+            for rows in ([[2], [3]], [[2], [3, 0]]):
+                with open(path, 'w') as records:
+                    records.write(json.dumps({'triangle': rows,
+                                              'target': 6}) + '\n')
+                for command in ('solve', 'validate'):
+                    with contextlib.redirect_stderr(io.StringIO()):
+                        self.assertEqual(cli.main([command, path]), 2)
+
+    def test_pure_search(self):
+        self.assertEqual(_pure.solve_rows(self.triangle, self.target), 'RLR')
+        with self.assertRaises(ValueError):
+            _pure.solve_rows(self.triangle, 11)
+        triangle = [[2], [3, 3], [5, 6, 7]]
+        self.assertEqual(_pure.count_rows(triangle, 2 * 3 * 6), 2)
+        self.assertEqual(_pure.count_rows(triangle, 11), 0)
+
+    def test_path_bitmasks(self):
+        puzzle = triangle_puzzle.TrianglePuzzle(self.triangle, self.target)
+        puzzle.solve(method='dfs')
+        self.assertEqual(puzzle.solution_mask_, 0b101)
+        self.assertEqual(puzzle.solution_, 'RLR')
+        paths = ['LLL', 'RLR', 'RRR']
+        self.assertEqual(puzzle.evaluate_paths(paths).tolist(),
+                         [2 * 3 * 5 * 1, self.target, 2 * 4 * 7 * 4])
+        self.assertEqual(puzzle.check_paths([0b000, 0b101, 0b111]).tolist(),
+                         [False, True, False])
+        with self.assertRaises(ValueError):
+            puzzle.solution_ = 'RLX'
+
+    def test_dedupe(self):
+        puzzle = triangle_puzzle.TrianglePuzzle(self.triangle, self.target)
+        same = triangle_puzzle.TrianglePuzzle(
+            [[int(value) for value in row] for row in self.triangle],
+            self.target)
+        other = triangle_puzzle.TrianglePuzzle(self.triangle, self.target * 2)
+        self.assertEqual(puzzle.fingerprint(), same.fingerprint())
+        self.assertNotEqual(puzzle.fingerprint(), other.fingerprint())
+        self.assertEqual(puzzle.fingerprint(include_target=False),
+                         other.fingerprint(include_target=False))
+        puzzles = [puzzle, other, same, puzzle]
+        with dedupe.PuzzleDeduplicator(capacity=2, batch_size=1) as seen:
+            self.assertEqual(list(seen.filter(puzzles)), [puzzle, other])
+            self.assertEqual(seen.n_duplicates, 2)
+        self.assertEqual(
+            list(dedupe.dedupe(puzzles * 50, capacity=1, key='triangle')),
+            [puzzle])
+
+    def test_solve_parallel(self):
+        puzzle = triangle_puzzle.TrianglePuzzle().make_random(
+            12, 'hard', random_state=3)
+        expected = puzzle.solve(method='dp')
+        for workers, split_depth in ((1, None), (2, None), (2, 4)):
+            unsolved = triangle_puzzle.TrianglePuzzle(puzzle.triangle,
+                                                      puzzle.target)
+            self.assertEqual(unsolved.solve_parallel(
+                workers=workers, split_depth=split_depth), expected)
+        with self.assertRaises(ValueError):
+            triangle_puzzle.TrianglePuzzle(self.triangle, 7).solve_parallel(
+                workers=2)
+        with self.assertRaises(ValueError):
+            puzzle.solve_parallel(split_depth=12)
+
+    def test_overflow_safe_products(self):
+        # every product overflows int64
+        big = 1 << 40
+        rows = [[big], [big, big + 1], [big, 3, big << 22]]
+        products = triangle_puzzle.evaluate_paths(rows, [0b00, 0b01, 0b10,
+                                                         0b11])
+        self.assertEqual(products.tolist(), [big ** 3, big * (big + 1) * 3,
+                                             big ** 2 * 3,
+                                             big * (big + 1) * (big << 22)])
+        self.assertEqual(triangle_puzzle.check_paths(
+            rows, big ** 2 * 3, [0b00, 0b01, 0b10, 0b11]).tolist(),
+            [False, False, True, False])
+        # big * (big + 1) * 3 wraps around to 3 * big in int64
+        self.assertFalse(triangle_puzzle.check_paths(
+            rows, 3 * big, [0b00, 0b01, 0b10, 0b11]).any())
+        puzzle = triangle_puzzle.TrianglePuzzle(rows)
+        valid, targets = puzzle._is_valid_puzzle()
+        self.assertTrue(valid)
+        self.assertIn(big ** 3, targets)
+
+    def test_large_prime_factors(self):
+        # both primes are above the trial-division table, so p * q is only
+        # split by Pollard's rho
+        p, q = 1048583, 1048589
+        rows = [[p * q], [p, p]]
+        for method in ('dfs', 'dp'):
+            puzzle = triangle_puzzle.TrianglePuzzle(rows, p * q * p)
+            self.assertEqual(puzzle.solve(method=method), 'L')
+        self.assertEqual(puzzle.count_solutions(), 2)
+        self.assertEqual(triangle_puzzle.ProductIndex(rows).count(p * q * p),
+                         2)
+        self.assertEqual(triangle_puzzle._prime_factors(p * q * q),
+                         {p: 1, q: 2})
@@ -0,0 +1,228 @@
+'''
+A binary archive format for collections of triangle puzzles.
+
+An archive is a data file and an index file next to it (the same path with
+'.idx' appended). The data file starts with an 8-byte magic and then holds
+one record per puzzle:
+
+    uint32   number of rows
+    uint8    size in bytes of each triangle value (1, 2, 4 or 8)
+    uint8    flags (1 = has a solution)
+    uint16   size in bytes of the target (0 = no target)
+    bytes    target, unsigned little-endian
+    bytes    triangle values row by row, unsigned little-endian
+    bytes    solution bitmask, bit k set when move k is 'R'
+
+The index file is the uint64 little-endian offset of every record in the
+data file. Both files are memory-mapped when an archive is opened, so
+opening it and fetching any one puzzle does not depend on its size.
+'''
+
+import mmap
+import os
+import struct
+import numpy as np
+from .triangle_puzzle import (Triangle, TrianglePuzzle, iter_txt_puzzles,
+                              _solution_from_mask)
+
+_MAGIC = b'LPTA\x01\x00\x00\x00'
+_RECORD_HEADER = struct.Struct('<IBBH')
+_HAS_SOLUTION = 1
+_VALUE_DTYPES = {1: '<u1', 2: '<u2', 4: '<u4', 8: '<i8'}
+# offsets are written to the index in blocks of this many records
+_INDEX_BLOCK = 4096
+
+
+class TriangleArchive:
+    '''
+    Read-only random access to the puzzles of an archive. Indexing the
+    archive materializes only the puzzle asked for, and the triangles of
+    int64 archives are views of the mapped file rather than copies.
+
+    Parameters
+    ----------------------------------
+    path : str
+        indicates the path to the archive's data file
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as data_file:
+            if data_file.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f'{path} is not a puzzle archive.')
+            self._data = mmap.mmap(data_file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        index_path = _index_path(path)
+        if os.path.getsize(index_path):
+            self._index = np.memmap(index_path, dtype='<u8', mode='r')
+        else:
+            self._index = np.empty(0, dtype='<u8')
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(len(self))[i]]
+        return _read_record(self._data, int(self._index[range(len(self))[i]]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        self._index = np.empty(0, dtype='<u8')
+        try:
+            self._data.close()
+        except BufferError:
+            # Puzzles read from the archive still view its values, and the
+            # mapping goes away with the last of them
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_archive(path):
+    '''
+    Opens an archive for random access.
+
+    Parameters
+    ----------------------------------
+    path : str
+        indicates the path to the archive's data file
+
+    Returns
+    ----------------------------------
+    archive : TriangleArchive
+    '''
+    return TriangleArchive(path)
+
+
+def write_archive(puzzles, path, append=True):
+    '''
+    Writes puzzles to an archive, creating it if it does not exist.
+
+    Parameters
+    ----------------------------------
+    puzzles : iterable of TrianglePuzzle
+    path : str
+        indicates the path to the archive's data file
+    append : bool, default=True
+        when False, any existing archive at path is replaced
+
+    Returns
+    ----------------------------------
+    n_written : int
+    '''
+    mode = 'ab' if append else 'wb'
+    n_written = 0
+    with open(path, mode) as data_file, \
+            open(_index_path(path), mode) as index_file:
+        if data_file.tell() == 0:
+            data_file.write(_MAGIC)
+        offsets = []
+        for puzzle in puzzles:
+            offsets.append(data_file.tell())
+            data_file.write(_pack_record(puzzle))
+            if len(offsets) == _INDEX_BLOCK:
+                data_file.flush()
+                index_file.write(np.asarray(offsets, dtype='<u8').tobytes())
+                n_written += len(offsets)
+                offsets = []
+        data_file.flush()
+        index_file.write(np.asarray(offsets, dtype='<u8').tobytes())
+        n_written += len(offsets)
+    return n_written
+
+
+def txt_to_archive(txt_path, path, append=True):
+    '''
+    Converts a multi-puzzle .txt file to an archive, one puzzle at a time.
+
+    Parameters
+    ----------------------------------
+    txt_path : str
+        indicates the path to the text file
+    path : str
+        indicates the path to the archive's data file
+    append : bool, default=True
+        when False, any existing archive at path is replaced
+
+    Returns
+    ----------------------------------
+    n_written : int
+    '''
+    return write_archive(iter_txt_puzzles(txt_path), path, append=append)
+
+
+def _index_path(path):
+    return f'{path}.idx'
+
+
+def _pack_record(puzzle):
+    '''
+    Helper function for write_archive(). Packs one puzzle into a record.
+    '''
+    values = puzzle.triangle.values
+    n_rows = len(puzzle.triangle)
+    largest = int(values.max()) if values.size else 0
+    itemsize = next(size for size in (1, 2, 4, 8)
+                    if size == 8 or largest < 1 << (8 * size))
+
+    if puzzle.target is None:
+        target = b''
+    else:
+        target = int(puzzle.target)
+        target = target.to_bytes(max((target.bit_length() + 7) // 8, 1),
+                                 'little')
+
+    flags = 0
+    solution = b''
+    if puzzle.solution_mask_ is not None:
+        flags |= _HAS_SOLUTION
+        solution = puzzle.solution_mask_.to_bytes(_solution_nbytes(n_rows),
+                                                  'little')
+
+    return b''.join((
+        _RECORD_HEADER.pack(n_rows, itemsize, flags, len(target)),
+        target,
+        values.astype(_VALUE_DTYPES[itemsize]).tobytes(),
+        solution))
+
+
+def _read_record(data, offset):
+    '''
+    Helper function for TriangleArchive. Materializes the puzzle whose
+    record starts at offset.
+    '''
+    n_rows, itemsize, flags, target_nbytes = _RECORD_HEADER.unpack_from(
+        data, offset)
+    offset += _RECORD_HEADER.size
+    target = None
+    if target_nbytes:
+        target = int.from_bytes(data[offset:offset + target_nbytes],
+                                'little')
+        offset += target_nbytes
+
+    n_values = n_rows * (n_rows + 1) // 2
+    values = np.frombuffer(data, dtype=_VALUE_DTYPES[itemsize],
+                           count=n_values, offset=offset)
+    if itemsize != 8:
+        # narrower values are widened, 8-byte ones stay a view of the file
+        values = values.astype(np.int64)
+    puzzle = TrianglePuzzle(Triangle(values), target)
+    offset += n_values * itemsize
+
+    if flags & _HAS_SOLUTION:
+        nbytes = _solution_nbytes(n_rows)
+        mask = int.from_bytes(data[offset:offset + nbytes], 'little')
+        puzzle.solution_ = _solution_from_mask(mask, n_rows - 1)
+    return puzzle
+
+
+def _solution_nbytes(n_rows):
+    return (max(n_rows - 1, 0) + 7) // 8
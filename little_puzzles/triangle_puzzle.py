@@ -3,7 +3,51 @@ The triangle puzzle and solver.
 '''
 
 import numpy as np
-from collections import defaultdict
+import contextlib
+import hashlib
+import io
+import itertools
+import math
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+from ._pure import (iter_txt_records, render, _parse_txt_line, _txt_target)
+
+# make_random counts every product for triangles up to this many rows and
+# certifies sampled targets meet-in-the-middle above it
+_ENUMERATION_ROWS = 16
+# candidate targets tried on one triangle before it is resampled
+_TARGET_ATTEMPTS = 8
+# remaining targets one row of the meet-in-the-middle count of a sampled
+# target may hold before the target is given up, which bounds its memory
+_SAMPLE_STATES = 1 << 14
+# times the incremental generator redraws one row before it starts over
+_ROW_ATTEMPTS = 4
+# remaining targets the constructive generator lets one row keep before it
+# prefers values that end the other paths
+_CONSTRUCTIVE_STATES = 1 << 12
+# solve_parallel() splits the search into at least this many subproblems per
+# worker, and its workers check for cancellation every _CANCEL_INTERVAL nodes
+_SPLIT_TASKS = 8
+_CANCEL_INTERVAL = 1 << 12
+# float64 rounding allowed per row when the summed log2 values of a path are
+# compared with log2 of a target, paths further off cannot reach it
+_LOG_TOLERANCE = 2.0 ** -30
+_INT64_MAX = (1 << 63) - 1
+
+# values are factored by trial division against primes up to this limit
+_PRIME_TABLE_LIMIT = 1 << 20
+_PRIME_TABLE = np.array([2, 3, 5, 7])
+
+SolveResult = namedtuple('SolveResult', ['index', 'solution', 'error'])
+SolveResult.__doc__ = '''
+Outcome of one puzzle in solve_many(). index is the position of the puzzle
+in the input, solution is its 'L'/'R' string (None on failure) and error is
+the failure message (None on success).
+'''
 
 
 class TrianglePuzzle:
@@ -24,7 +68,7 @@ class TrianglePuzzle:
 
     Parameters
     ----------------------------------
-    triangle : list of lists
+    triangle : Triangle or list of lists
         lists consist of positive integers and each list must be one item
         longer than the one previous
     target : int (positive)
@@ -32,14 +76,41 @@ class TrianglePuzzle:
 
     Attributes
     ----------------------------------
+    triangle : Triangle
+        the values of the triangle, stored flat
     solution_ : str
-        consisting of 'L' and 'R' specifying the steps that solve the puzzle.
+        consisting of 'L' and 'R' specifying the steps that solve the puzzle,
+        a view of solution_mask_
+    solution_mask_ : int or None
+        the solution as a bitmask, bit k set when move k is 'R'
+    stats_ : SearchStats or None
+        counters and phase timings of the last instrumented solve() or
+        make_random()
     '''
 
     def __init__(self, triangle=None, target=None):
-        self.triangle = triangle
+        self.triangle = None
+        if triangle is not None:
+            self.set_triangle(triangle)
         self.target = target
         self.solution_ = None
+        self.stats_ = None
+        self._product_index = None
+
+    @property
+    def solution_(self):
+        if self.solution_mask_ is None:
+            return None
+        return _solution_from_mask(self.solution_mask_, self._solution_moves)
+
+    @solution_.setter
+    def solution_(self, solution):
+        if solution is None:
+            self.solution_mask_ = None
+            self._solution_moves = 0
+        else:
+            self.solution_mask_ = _mask_from_solution(solution)
+            self._solution_moves = len(solution)
 
     def read_txt_file(self, text_file_path):
         '''
@@ -54,29 +125,22 @@ class TrianglePuzzle:
         ----------------------------------
         self
         '''
-        puzzle = open(text_file_path, 'r').readlines()
         triangle = []
-        for line in puzzle:
-            if line[-1] == '\n':
-                line = line[:-1]
-            if line.strip()[0].isdigit():
-                if ',' in row:
-                    row = [int(s) for s in line.split(',') if s.isdigit()]
-                elif ' ' in row:
-                    row = [int(s) for s in line.split(' ') if s.isdigit()]
-                triangle.append(row)
-            else:
-                target = [int(s) for s in line.split(' ') if s.isdigit()]
-
-        # Check to make sure only 1 target in list
-        if len(target) > 1:
-            raise ValueError('More than one target was specified in the file.')
-        elif len(target) < 1:
-            raise ValueError('Could not find a target value in the file.')
-        else:
-            self.set_target(target[0])
-
+        target = []
+        solution = None
+        with open(text_file_path, 'r') as txt_file:
+            for line in txt_file:
+                kind, content = _parse_txt_line(line)
+                if kind == 'row':
+                    triangle.append(content)
+                elif kind == 'target':
+                    target = content
+                elif kind == 'solution':
+                    solution = content
+
+        self.set_target(_txt_target(target))
         self.set_triangle(triangle)
+        self.solution_ = solution
         return self
 
     def set_triangle(self, triangle):
@@ -86,7 +150,7 @@ class TrianglePuzzle:
 
         Parameters
         ----------------------------------
-        triangle : list of lists
+        triangle : Triangle or list of lists
             lists consist of positive integers and each list must be one item
             longer than the one previous
 
@@ -94,16 +158,10 @@ class TrianglePuzzle:
         ----------------------------------
         self
         '''
-        for row, values in enumerate(triangle):
-            if len(values) != row + 1:
-                raise ValueError('The triangle is not the correct shape.')
-            for value in values:
-                try:
-                    value = int(value)
-                except ValueError:
-                    print('Could not convert one or more values to an int.')
-                    raise
+        if not isinstance(triangle, Triangle):
+            triangle = Triangle.from_rows(triangle)
         self.triangle = triangle
+        self._product_index = None
         return self
 
     def set_target(self, target):
@@ -126,27 +184,70 @@ class TrianglePuzzle:
             print('Could not convert target value to an integer.')
         return self
 
-    def solve(self):
+    def solve(self, method='dfs', stats=False, callback=None):
         '''
         Generates the solution to the puzzle.
 
+        Parameters
+        ----------------------------------
+        method : str, default='dfs'
+            options are 'dfs' and 'dp'. 'dfs' walks the triangle left-first
+            with a solution tracker. 'dp' runs the same left-first search but
+            remembers dead (row, position, remaining target) states so that
+            no sub-triangle is searched twice for the same quotient.
+        stats : bool, default=False
+            indicates whether to count search events and time the phases of
+            the search into self.stats_
+        callback : callable, default=None
+            called as callback(event, row, position) on every search event
+            (see SearchStats), implies stats=True
+
         Returns
         ----------------------------------
         self.solution : str
             the solution to the puzzle consisting of 'L' and 'R' indicating
             the moves taken in the solution path.
         '''
+        if method not in ('dfs', 'dp'):
+            raise ValueError('Options for method are \'dfs\' or \'dp\'.')
+        if stats or callback is not None:
+            self.stats_ = SearchStats(callback=callback)
+        else:
+            self.stats_ = None
+
+        with _phase(self.stats_, 'setup'):
+            arithmetic = _PrimeExponents(self.target, self.triangle)
+        with _phase(self.stats_, 'search'):
+            if method == 'dp':
+                self.solution_ = self._solve_dp(arithmetic, self.stats_)
+            else:
+                self.solution_ = self._solve_dfs(arithmetic, self.stats_)
+        if self.stats_ is not None:
+            self.stats_.record('solution')
+        return self.solution_
+
+    def _solve_dfs(self, arithmetic, stats=None):
+        '''
+        Helper function for self.solve(). Left-first search with a
+        TriangleSolutionTracker.
+
+        Returns
+        ----------------------------------
+        solution : str
+            consisting of 'L' and 'R' indicating the moves in the solution
+        '''
         # Initiate tracker
         rows = len(self.triangle)
         tracker = TriangleSolutionTracker()
+        tracker.stats = stats
 
-        value = self.triangle[tracker.current_row][tracker.current_position]
-        current_target = self.target / value
+        value = self.triangle[tracker.current_row, tracker.current_position]
+        current_target = arithmetic.divide(arithmetic.target, 0)
         tracker._make_move(value=value)
 
         # If the value at the top of the triangle is not a factor of the
         # target, there is no solution to the puzzle, so raise an error
-        if self.target % value != 0:
+        if current_target is None:
             raise ValueError('There is no solution to this puzzle.')
 
         else:
@@ -154,22 +255,262 @@ class TrianglePuzzle:
                 # If we've reached the final row
                 if tracker.current_row == rows:
                     # If the puzzle has been solved, produce the output
-                    if self.target == np.prod(tracker.values):
-                        self.solution_ = ''.join(tracker.output)
-                        return self.solution_
+                    if current_target == arithmetic.one:
+                        return tracker.output
                     # If we have not reached the target, backtrack
                     else:
                         current_target, tracker = self._backtrack(
-                            tracker=tracker)
-                        tracker.current_row -= 1
+                            tracker=tracker, current_target=current_target,
+                            arithmetic=arithmetic)
 
                 # Determine next possible move
                 else:
                     current_target, tracker = self._next_move(
                         current_target=current_target, tracker=tracker,
-                        backtrack=False)
+                        arithmetic=arithmetic, backtrack=False)
+
+    def _solve_dp(self, arithmetic, stats=None):
+        '''
+        Helper function for self.solve(). Left-first search over
+        (row, cell, remaining target) states. The remaining target is kept as
+        packed prime exponents (see _PrimeExponents) and divided down exactly
+        as moves are made, and every state whose sub-triangle cannot reach the
+        target is remembered so it is never expanded again.
+
+        Returns
+        ----------------------------------
+        solution : str
+            consisting of 'L' and 'R' indicating the moves in the solution
+        '''
+        remaining = arithmetic.divide(arithmetic.target, 0)
+        if remaining is None:
+            raise ValueError('There is no solution to this puzzle.')
+        solution = _search_dp(arithmetic, len(self.triangle) - 1, 0, 0,
+                              remaining, set(), stats)
+        if solution is None:
+            raise ValueError('There is no solution to this puzzle.')
+        return solution
 
-    def _next_move(self, tracker, current_target, backtrack=False):
+    def solve_parallel(self, workers=None, split_depth=None):
+        '''
+        Solves one large puzzle across a pool of processes.
+
+        The search tree is split at split_depth rows into independent
+        subproblems, each a path prefix and the quotient of the target left
+        after it, in left-first order. The workers read the triangle from
+        shared memory and search the subproblems as solve(method='dp') does,
+        each remembering the dead states it finds across its subproblems. As
+        soon as a worker finds a path, every subproblem to the right of it is
+        cancelled, while the ones to its left are finished, so the solution is
+        the same left-first path that solve() returns.
+
+        Parameters
+        ----------------------------------
+        workers : int, default=None
+            number of worker processes, None uses every core and 1 searches
+            the subproblems in the calling process
+        split_depth : int, default=None
+            row at which the search tree is split, None picks the first row
+            with at least _SPLIT_TASKS subproblems per worker
+
+        Returns
+        ----------------------------------
+        self.solution : str
+            the solution to the puzzle consisting of 'L' and 'R' indicating
+            the moves taken in the solution path.
+        '''
+        workers = workers or os.cpu_count() or 1
+        self.stats_ = None
+        arithmetic = _PrimeExponents(self.target, self.triangle)
+        last_row = len(self.triangle) - 1
+        if split_depth is None:
+            split_depth = last_row
+            min_tasks = _SPLIT_TASKS * workers
+        elif not 0 <= split_depth <= last_row:
+            raise ValueError(f'split_depth must be between 0 and {last_row}.')
+        else:
+            min_tasks = None
+        tasks = _split_search(arithmetic, split_depth, min_tasks)
+
+        if workers == 1:
+            dead = set()
+            for prefix, row, cell, remaining in tasks:
+                solution = _search_dp(arithmetic, last_row, row, cell,
+                                      remaining, dead)
+                if solution is not None:
+                    self.solution_ = prefix + solution
+                    return self.solution_
+            raise ValueError('There is no solution to this puzzle.')
+
+        found = multiprocessing.Value('q', len(tasks))
+        values = multiprocessing.RawArray('q', len(self.triangle.values))
+        np.frombuffer(values, dtype=np.int64)[:] = self.triangle.values
+        solutions = {}
+        done = set()
+        # every subproblem left of this one has been searched
+        searched = 0
+        with multiprocessing.Pool(workers, initializer=_init_search_worker,
+                                  initargs=(values, self.target, found)) as pool:
+            for index, solution in pool.imap_unordered(
+                    _search_task, enumerate(tasks)):
+                done.add(index)
+                if solution is not None:
+                    solutions[index] = solution
+                while searched in done:
+                    searched += 1
+                if searched >= min(solutions, default=len(tasks)):
+                    break
+        if not solutions:
+            raise ValueError('There is no solution to this puzzle.')
+        best = min(solutions)
+        self.solution_ = tasks[best][0] + solutions[best]
+        return self.solution_
+
+    def iter_solutions(self):
+        '''
+        Lazily yields every path down the triangle whose product is the
+        target, left-first. Only the current path is kept on a stack, along
+        with the (cell, remaining target) states known to lead nowhere, so
+        that no sub-triangle is searched twice for the same quotient.
+
+        Yields
+        ----------------------------------
+        solution : str
+            consisting of 'L' and 'R' indicating the moves of one path
+        '''
+        arithmetic = _PrimeExponents(self.target, self.triangle)
+        vectors = arithmetic.vectors
+        one = arithmetic.one
+        last_row = len(self.triangle) - 1
+
+        remaining = arithmetic.divide(arithmetic.target, 0)
+        if remaining is None:
+            return
+
+        dead = set()
+        # Each frame holds [row, cell, remaining target, next direction,
+        # whether a solution was found below it], as in self._solve_dp().
+        stack = [[0, 0, remaining, 0, False]]
+        while stack:
+            frame = stack[-1]
+            row, cell, remaining, direction, found = frame
+            if row == last_row:
+                if remaining == one:
+                    found = True
+                    yield ''.join(
+                        'R' if child[1] - parent[1] > parent[0] + 1 else 'L'
+                        for parent, child in zip(stack, stack[1:]))
+                direction = 2
+            if direction == 2:
+                stack.pop()
+                if found and stack:
+                    stack[-1][4] = True
+                elif not found:
+                    dead.add((cell, remaining))
+                continue
+            frame[3] += 1
+            next_cell = cell + row + 1 + direction
+            quotient = remaining - vectors[next_cell]
+            if quotient & one == one and (next_cell, quotient) not in dead:
+                stack.append([row + 1, next_cell, quotient, 0, False])
+
+    def count_solutions(self, target=None):
+        '''
+        Counts the paths down the triangle whose product is the target
+        without enumerating them, from the product index once one is built
+        (see self.product_index()) and meeting in the middle otherwise (see
+        _count_paths_mitm()).
+
+        Parameters
+        ----------------------------------
+        target : int, default=None
+            product to count the paths to, None for self.target
+
+        Returns
+        ----------------------------------
+        n_solutions : int
+        '''
+        if target is None:
+            target = self.target
+        if not target or not self.triangle:
+            return 0
+        index = self._product_index
+        if index is not None and index.triangle is self.triangle:
+            return index.count(target)
+        return _count_paths_mitm(self.triangle, target)
+
+    def product_index(self, max_rows=_ENUMERATION_ROWS, cache_size=1024):
+        '''
+        Returns the ProductIndex of the triangle, building it on the first
+        call. The index is kept until the triangle changes, and once it is
+        built self.count_solutions() answers from it.
+
+        Parameters
+        ----------------------------------
+        max_rows : int, default=_ENUMERATION_ROWS
+            passed to ProductIndex
+        cache_size : int, default=1024
+            passed to ProductIndex
+
+        Returns
+        ----------------------------------
+        index : ProductIndex
+        '''
+        index = self._product_index
+        if (index is None or index.triangle is not self.triangle
+                or index.max_rows != max_rows):
+            index = ProductIndex(self.triangle, max_rows=max_rows,
+                                 cache_size=cache_size)
+            self._product_index = index
+        index.cache_size = cache_size
+        return index
+
+    def evaluate_paths(self, paths):
+        '''
+        Evaluates the products of many paths down the triangle in one call
+        (see evaluate_paths()).
+        '''
+        return evaluate_paths(self.triangle, paths)
+
+    def check_paths(self, paths):
+        '''
+        Checks many paths against the target in one call (see
+        check_paths()).
+        '''
+        return check_paths(self.triangle, self.target, paths)
+
+    def fingerprint(self, include_target=True):
+        '''
+        Canonical digest of the puzzle: two puzzles with the same triangle
+        (and target) have the same fingerprint whatever the dtype or layout
+        they were built from.
+
+        Parameters
+        ----------------------------------
+        include_target : bool, default=True
+            indicates whether the target is part of the fingerprint, False
+            fingerprints the triangle alone
+
+        Returns
+        ----------------------------------
+        fingerprint : bytes
+            16-byte BLAKE2b digest
+        '''
+        digest = hashlib.blake2b(digest_size=16)
+        values = (self.triangle.values if self.triangle is not None
+                  else np.empty(0, dtype=np.int64))
+        # the number of values comes first so that the values and the
+        # target cannot run into one another
+        digest.update(len(values).to_bytes(8, 'little'))
+        digest.update(values.astype('<i8', copy=False).tobytes())
+        if include_target and self.target is not None:
+            target = int(self.target)
+            digest.update(target.to_bytes((target.bit_length() + 8) // 8,
+                                          'little', signed=True))
+        return digest.digest()
+
+    def _next_move(self, tracker, current_target, arithmetic,
+                   backtrack=False):
         '''
         Helper function for self.solve(). Determines the next move to make.
         Checks if moving left will land on a value that is a factor of the
@@ -180,43 +521,55 @@ class TrianglePuzzle:
         Returns
         ----------------------------------
         current_target : int
-            dividend of self.target and values visited in the current path
+            packed exponents of the dividend of self.target and values
+            visited in the current path
         tracker : TriangleSolutionTracker
             current state of the solution tracker
         '''
+        row = tracker.current_row
+        cell = row * (row + 1) // 2 + tracker.current_position
+        stats = tracker.stats
         if not backtrack:
-            valueL = self.triangle[tracker.current_row][
-                tracker.current_position]
             # Check if we can move left
-            if current_target % valueL == 0:
+            quotient = arithmetic.divide(current_target, cell)
+            if quotient is not None:
                 # Update variables with values from move
-                current_target = current_target / valueL
+                valueL = self.triangle[row, tracker.current_position]
                 tracker._make_move(value=valueL, direction='L')
-                return current_target, tracker
+                if stats is not None:
+                    stats.record('node', row, tracker.current_position)
+                return quotient, tracker
+            if stats is not None:
+                stats.record('prune', row, tracker.current_position)
 
-        valueR = self.triangle[tracker.current_row][
-            tracker.current_position + 1]
         # Check if we can move right
-        if current_target % valueR == 0:
+        quotient = arithmetic.divide(current_target, cell + 1)
+        if stats is not None:
+            stats.record('prune' if quotient is None else 'node', row,
+                         tracker.current_position + 1)
+        if quotient is not None:
             # Update variables with values from move
-            current_target = current_target / valueR
+            valueR = self.triangle[row, tracker.current_position + 1]
             tracker._make_move(value=valueR, direction='R')
+            current_target = quotient
         # If we could not make a move from the current position, backtrack up
         # the triangle.
         else:
-            current_target, tracker = self._backtrack(tracker)
-            tracker.current_row += 1
+            current_target, tracker = self._backtrack(
+                tracker, current_target, arithmetic)
         return current_target, tracker
 
-    def _backtrack(self, tracker):
+    def _backtrack(self, tracker, current_target, arithmetic):
         '''
         Helper function to self.solve(). When the solver hits a dead end,
-        retraces steps to the first possible change.
+        retraces steps to the first possible change, multiplying the values
+        it leaves back into the current target.
 
         Returns
         ----------------------------------
         current_target : int
-            dividend of self.target and values visited in the current path
+            packed exponents of the dividend of self.target and values
+            visited in the current path
         tracker : TriangleSolutionTracker
             current state of the solution tracker
         '''
@@ -224,24 +577,28 @@ class TrianglePuzzle:
         # The solution function will always try to move left before it tries
         # to move right, so if there are only moves to the right, we have
         # checked every possiblity, so raise an error
-        if 'L' not in tracker.output:
+        if tracker.mask == (1 << tracker.n_moves) - 1:
             raise ValueError('There is no solution to this puzzle.')
 
         else:
+            stats = tracker.stats
+            if stats is not None:
+                stats.record('backtrack', tracker.current_row - 1,
+                             tracker.current_position)
             # Retrace moves up to most recent 'left' move.
             # Update necessary variables.
-            while tracker.output.pop() == 'R':
-                tracker.current_row -= 1
-                tracker.current_position -= 1
-                tracker.values.pop()
-            tracker.values.pop()
-            tracker.current_row -= 1
-
-            product = np.prod(tracker.values)
-            # Re-calculate current_target
-            current_target = self.target / product
+            while True:
+                row = tracker.current_row - 1
+                cell = row * (row + 1) // 2 + tracker.current_position
+                current_target = arithmetic.multiply(current_target, cell)
+                if stats is not None:
+                    stats.record('recompute', row, tracker.current_position)
+                if tracker._undo_move() == 'L':
+                    break
+
             current_target, tracker = self._next_move(
-                tracker=tracker, current_target=current_target, backtrack=True)
+                tracker=tracker, current_target=current_target,
+                arithmetic=arithmetic, backtrack=True)
         # Return
         return current_target, tracker
 
@@ -263,11 +620,9 @@ class TrianglePuzzle:
             indicates the degree of spacing between rows of the triangle and
             between the target, triangle, and solution
         '''
-        to_txt = self.display(show_solution=show_solution, spacing=spacing,
-                              line_spacing=line_spacing)
-        txt_file = open(path, 'w+')
-        txt_file.write(to_txt)
-        txt_file.close()
+        with open(path, 'w') as txt_file:
+            self._render(txt_file.write, show_solution=show_solution,
+                         spacing=spacing, line_spacing=line_spacing)
         return None
 
     def puzzle_key_to_txt(self, path_to_puzzle, path_to_solution, spacing=4,
@@ -292,14 +647,15 @@ class TrianglePuzzle:
         '''
         self.puzzle_to_txt(path=path_to_puzzle, spacing=spacing,
                            line_spacing=line_spacing)
-        self.puzzle_to_txt(path=path_to_solution, spacing=spacing,
-                           line_spacing=line_spacing)
+        self.puzzle_to_txt(path=path_to_solution, show_solution=True,
+                           spacing=spacing, line_spacing=line_spacing)
         return None
 
-    def display(self, show_solution=False, spacing=4, line_spacing=1):
+    def display(self, show_solution=False, spacing=4, line_spacing=1,
+                stream=None, quiet=False):
         '''
         Sets up the puzzle in an easily readable format. Ready to play or to
-        check the solution. Prints the output.
+        check the solution. Writes the output to a stream, stdout by default.
 
         Parameters
         ----------------------------------
@@ -312,6 +668,10 @@ class TrianglePuzzle:
         line_spacing : int, default=1
             indicates the degree of spacing between rows of the triangle and
             between the target, triangle, and solution
+        stream : file-like, default=None
+            text stream to write the output to, None for stdout
+        quiet : bool, default=False
+            indicates whether to only return the output without writing it
 
         Returns
         ----------------------------------
@@ -319,148 +679,1761 @@ class TrianglePuzzle:
             nicely formatted string that includes the target and triangle and
             (optionally) the solution
         '''
-        if self.target:
-            target_str = f'Target: {self.target}' + ('\n' * line_spacing)
-            print(target_str)
-        else:
-            target_str = ''
-
-        if self.triangle:
-            rows = len(self.triangle)
-            triangle_str = ''
-            indents = rows - 1
-            for i, row in enumerate(rows):
-                row_indent = indents - i
-                for j, value in enumerate(row):
-                    if j == 0:
-                        triangle_str += _make_indent(value, spacing=spacing,
-                                                     row_indent=row_indent)
-                    else:
-                        triangle_str += _make_indent(value, prev=row[j - 1],
-                                                     spacing=spacing)
-                    triangle_str += str(value)
-                triangle_str += ('\n' * line_spacing)
-            print(triangle_str)
-        else:
-            triangle_str = ''
-
-        if show_solution and self.solution_:
-            solution_str = f'Solution: {self.solution_}\n'
-            print(solution_str)
-        else:
-            solution_str = ''
-
-        puzzle_str = target_str + triangle_str + solution_str
+        buffer = io.StringIO()
+        self._render(buffer.write, show_solution=show_solution,
+                     spacing=spacing, line_spacing=line_spacing)
+        puzzle_str = buffer.getvalue()
+        if not quiet:
+            (stream or sys.stdout).write(puzzle_str)
         return puzzle_str
 
-    def make_random(self, n_rows=5, level=None):
+    def _render(self, write, show_solution=False, spacing=4, line_spacing=1):
+        '''
+        Helper function for self.display() and the text writers. Writes the
+        target, the triangle and (optionally) the solution, one call to write
+        for each.
+
+        Parameters
+        ----------------------------------
+        write : callable
+            called with each formatted section, such as a stream's write
+        '''
+        triangle = self.triangle
+        values = largest = None
+        if triangle:
+            values = triangle.values.tolist()
+            largest = int(triangle.values.max())
+        render(write, triangle, self.target, self.solution_,
+               show_solution=show_solution, spacing=spacing,
+               line_spacing=line_spacing, values=values, largest=largest)
+
+    def make_random(self, n_rows=5, level=None, random_state=None,
+                    stats=False, callback=None, method=None):
         '''
         Constructs a random triangle puzzle that has a single, valid solution.
 
+        The 'incremental' method grows the triangle one row at a time while
+        counting the paths to every (cell, product) state, redraws a row as
+        soon as no state is reached by exactly one path any more and starts
+        over after _ROW_ATTEMPTS redraws of the same row. The target is drawn
+        from the products reached by exactly one path.
+
+        The 'sample' method draws the whole triangle at once. Up to
+        _ENUMERATION_ROWS rows it counts the paths to every product, above it
+        takes the product of a random path as a candidate target and
+        certifies it with a meet-in-the-middle count, giving the candidate up
+        as soon as a row of the count holds more than _SAMPLE_STATES
+        remaining targets. Its memory is bounded, but tall random triangles
+        rarely have a target that can be certified, so it can take minutes
+        above 30 rows.
+
+        The 'constructive' method draws the solution path and its values
+        first and then fills in the other cells row by row, each from the
+        values that cannot let a second path reach the target. It never
+        throws work away, so its latency only depends on n_rows, and it
+        also sets self.solution_.
+
         Parameters
         ----------------------------------
         n_rows : int
-            a number between 2 and 12 inclusive
+            a positive number of rows
         level : str
             options are 'easy', 'medium', and 'hard'
+        random_state : None, int, numpy.random.Generator or RandomState
+            source of randomness, None uses the global numpy.random state
+        stats : bool, default=False
+            indicates whether to count sampled triangles, candidate targets
+            and rejections and time the sampling and validation into
+            self.stats_
+        callback : callable, default=None
+            called as callback(event, row, position) on every generator
+            event (see SearchStats), implies stats=True
+        method : str, default=None
+            options are 'incremental', 'sample' and 'constructive', None
+            picks 'incremental' up to _ENUMERATION_ROWS rows and
+            'constructive' above
 
         Returns self
         '''
-        if n_rows >= 12:
-            raise ValueError('The maximum number of rows allowed is 11.')
-        if not level:
-            max_value = 3 * n_rows
+        if method is None:
+            method = ('incremental' if n_rows <= _ENUMERATION_ROWS
+                      else 'constructive')
+        elif method not in ('incremental', 'sample', 'constructive'):
+            raise ValueError(
+                'Options for method are \'incremental\', \'sample\', or '
+                '\'constructive\'.')
+        rng = _check_random_state(random_state)
+        if stats or callback is not None:
+            self.stats_ = SearchStats(callback=callback)
         else:
-            assert (level in set(['easy', 'medium', 'hard']),
-                    'Options for level are \'easy\', \'medium\', or \'hard\'.')
-        if level == 'easy':
-            max_value = 2 * n_rows
-        elif level == 'medium':
+            self.stats_ = None
+        self.solution_ = None
+        if n_rows < 1:
+            raise ValueError('The triangle must have at least one row.')
+        if level is None or level == 'medium':
             max_value = 3 * n_rows
-        else:
+        elif level == 'easy':
+            max_value = 2 * n_rows
+        elif level == 'hard':
             max_value = 4 * n_rows
+        else:
+            raise ValueError(
+                'Options for level are \'easy\', \'medium\', or \'hard\'.')
 
         values = list(range(2, (max_value + 1)))
         ratios = np.array(list(reversed(values)))
         probabilities = ratios / ratios.sum()
 
-        self.triangle = []
-        self.target = None
+        stats = self.stats_
+        if method == 'incremental':
+            self.target = None
+            self.triangle, targets = _grow_triangle(
+                n_rows, values, probabilities, rng, stats)
+            self.target = targets[rng.choice(len(targets))]
+            return self
+        if method == 'constructive':
+            self.target = None
+            self.triangle, self.target, self.solution_ = \
+                _construct_triangle(n_rows, values, probabilities, rng, stats)
+            return self
+
         valid = False
         while not valid:
-            for i in range(n_rows):
-                row = np.random.choice(values, size=(i + 1), p=probabilities)
-                self.triangle.append(row)
-
-            valid, targets = self._is_valid_puzzle()
-        self.target = np.random.choice(targets)
+            with _phase(stats, 'sample'):
+                self.triangle = Triangle(rng.choice(
+                    values, size=(n_rows * (n_rows + 1) // 2),
+                    p=probabilities))
+                self.target = None
+            if stats is not None:
+                stats.record('triangle')
+            with _phase(stats, 'validate'):
+                if n_rows <= _ENUMERATION_ROWS:
+                    valid, targets = self._is_valid_puzzle()
+                    if valid:
+                        self.target = targets[rng.choice(len(targets))]
+                else:
+                    for _ in range(_TARGET_ATTEMPTS):
+                        self.target = self._random_path_product(rng)
+                        if stats is not None:
+                            stats.record('candidate')
+                        n_paths = _count_paths_mitm(
+                            self.triangle, self.target,
+                            max_states=_SAMPLE_STATES)
+                        valid = n_paths == 1
+                        if valid:
+                            break
+                        if n_paths is None and stats is not None:
+                            stats.record('capped')
+                    else:
+                        self.target = None
+            if not valid and stats is not None:
+                stats.record('reject')
         return self
 
+    def _random_path_product(self, rng):
+        '''
+        Helper function for self.make_random(). Walks a random path down the
+        triangle and returns the exact product of the values it visits.
+        '''
+        moves = rng.choice(2, size=len(self.triangle) - 1)
+        positions = np.concatenate(([0], np.cumsum(moves)))
+        cells = self.triangle.offsets[:-1] + positions
+        product = 1
+        for value in self.triangle.values[cells].tolist():
+            product *= value
+        return product
+
     def _is_valid_puzzle(self):
         '''
-        Checks that the puzzle is valid with a single, unique solution.
+        Checks that the puzzle is valid with a single, unique solution. With a
+        target the paths reaching it are counted meet-in-the-middle, without
+        one every product is counted to find those that could be targets.
 
         Returns self, possible_targets : list of ints that could be valid
             targets to the puzzle.
         '''
-        possible_products = defaultdict(int)
-        n_moves = len(self.triangle) - 1
-        paths = list(range(2 ** n_moves))
-        for path in paths:
-            moves = bin(path)[2:]
-            while len(moves) < 4:
-                moves = '0' + moves
-            paths[path] = [int(move) for move in moves]
-        for path in paths:
-            values = [self.triangle[0][0]]
-            for row in range(len(moves)):
-                moves[row] = moves[row] + moves[row - 1]
-                values.append(self.triangle[row + 1][moves[row]])
-            product = np.prod(values)
-            possible_products[product] += 1
         if self.target:
-            if possible_products[str(self.target)] == 1:
+            if self.count_solutions() == 1:
                 return True, self.target
             else:
                 return False, None
         else:
-            possible_targets = []
-            for product, n in possible_products:
-                if n == 1:
-                    possible_targets.append(int(product))
+            products, counts = _path_product_counts(self.triangle)
+            possible_targets = [int(product)
+                                for product in products[counts == 1]]
             if len(possible_targets) == 0:
                 return False, None
             else:
                 return True, possible_targets
 
 
-def _make_indent(value, spacing=4, prev=None, row_indent=None):
+def _path_product_counts(triangle):
+    '''
+    Helper function for TrianglePuzzle._is_valid_puzzle(). Counts how many
+    paths down the triangle produce each product without enumerating the
+    paths: every cell holds an array of the distinct products of the paths
+    ending there and an array of their multiplicities, and each row is built
+    from the two cells above it.
+
+    Products are kept as int64 while they fit and each cell switches to
+    Python ints from the row where its own largest product might not (see
+    _scale_products()).
+
+    Returns
+    ----------------------------------
+    products : numpy.ndarray
+        distinct products of the complete paths, sorted
+    counts : numpy.ndarray
+        number of paths producing each product
+    '''
+    cells = _EMPTY_PRODUCTS
+    for values in triangle:
+        cells = _extend_products(cells, values)
+    return _merge_products(np.concatenate([p for p, _ in cells]),
+                           np.concatenate([c for _, c in cells]))
+
+
+# product table above the top row: the empty path, product 1
+_EMPTY_PRODUCTS = [(np.ones(1, dtype=np.int64), np.ones(1, dtype=np.int64))]
+
+
+def _extend_products(cells, values):
+    '''
+    Helper function for _path_product_counts() and _grow_triangle(). Builds
+    the product table of a new row from the table of the row above.
+
+    Parameters
+    ----------------------------------
+    cells : list of (numpy.ndarray, numpy.ndarray)
+        distinct products and their multiplicities of each cell of the row
+        above, _EMPTY_PRODUCTS above the top row
+    values : sequence of int
+        the new row
+
+    Returns
+    ----------------------------------
+    cells : list of (numpy.ndarray, numpy.ndarray)
+    '''
+    row = []
+    for position, value in enumerate(values):
+        # The cell is reached by moving right from position - 1 and by
+        # moving left from position of the row above.
+        parents = cells[max(position - 1, 0):position + 1]
+        products = _scale_products([p for p, _ in parents], value)
+        counts = np.concatenate([c for _, c in parents])
+        row.append(_merge_products(products, counts))
+    return row
+
+
+def _scale_products(parents, value):
+    '''
+    Helper function for _extend_products() and ProductIndex. Joins the
+    sorted products of the parents of a cell and multiplies them by its
+    value exactly, in int64 while the largest of them times the value stays
+    below 2**63 and in Python ints from then on.
+    '''
+    value = int(value)
+    products = np.concatenate(parents)
+    if products.dtype != object and max(
+            (int(p[-1]) for p in parents if len(p)),
+            default=0) > _INT64_MAX // value:
+        products = products.astype(object)
+    return products * value
+
+
+def _grow_triangle(n_rows, values, probabilities, rng, stats=None):
+    '''
+    Helper function for TrianglePuzzle.make_random(). Draws a triangle one
+    row at a time until some product is reached by exactly one path.
+
+    A path reaching a unique product passes through (cell, product) states
+    that are each reached by that path alone, so a row in which every state
+    is reached by two or more paths cannot lead to a unique product. Such a
+    row is redrawn on its own and, after _ROW_ATTEMPTS redraws, the triangle
+    is started over. The bottom row needs a product unique across the whole
+    row rather than in one cell.
+
+    Returns
+    ----------------------------------
+    triangle : Triangle
+    targets : list of int
+        products reached by exactly one path
+    '''
+    while True:
+        if stats is not None:
+            stats.record('triangle')
+        rows = []
+        tables = [_EMPTY_PRODUCTS]
+        attempts = 0
+        while len(rows) < n_rows and attempts < _ROW_ATTEMPTS:
+            row = len(rows)
+            drawn = rng.choice(values, size=row + 1, p=probabilities)
+            if stats is not None:
+                stats.record('row', row)
+            cells = _extend_products(tables[-1], drawn)
+            if row == n_rows - 1:
+                products, counts = _merge_products(
+                    np.concatenate([p for p, _ in cells]),
+                    np.concatenate([c for _, c in cells]))
+                unique = counts == 1
+            else:
+                unique = any((c == 1).any() for _, c in cells)
+            if np.any(unique):
+                rows.append(drawn)
+                tables.append(cells)
+                attempts = 0
+            else:
+                attempts += 1
+                if stats is not None:
+                    stats.record('resample', row)
+        if len(rows) == n_rows:
+            targets = [int(product) for product in products[unique]]
+            return Triangle(np.concatenate(rows)), targets
+        if stats is not None:
+            stats.record('reject')
+
+
+def _construct_triangle(n_rows, values, probabilities, rng, stats=None):
+    '''
+    Helper function for TrianglePuzzle.make_random(). Draws a solution path
+    and its values, then fills in the other cells so that no other path
+    reaches the product of the solution path.
+
+    Row by row, every cell keeps the set of remaining targets (the target
+    divided by the product of a path down to the cell) of the paths that
+    are still dividing the target. The solution path is the only path down
+    to the target as long as
+
+    - no other cell above a cell of the solution path shares its remaining
+      target, which forbids the values that divide one of the cell's
+      incoming remaining targets into the remaining target of the solution
+      path on that row, and
+    - no other cell of the bottom row divides a remaining target down to 1,
+      which forbids the values equal to one of its incoming remaining
+      targets.
+
+    Each cell is drawn from the allowed values only, so a triangle is only
+    started over in the rare case where every value is forbidden. Remaining
+    targets the rows left cannot divide down to 1 are dropped, and once a
+    row holds more than _CONSTRUCTIVE_STATES of them the other cells prefer
+    values that end every path through them, which bounds the work per row.
+
+    Returns
+    ----------------------------------
+    triangle : Triangle
+    target : int
+    solution : str
+    '''
+    values = np.asarray(values)
+    probabilities = np.asarray(probabilities)
+    largest = int(values.max())
+    smallest = int(values.min())
+    while True:
+        if stats is not None:
+            stats.record('triangle')
+        moves = rng.choice(2, size=n_rows - 1)
+        path = np.concatenate(([0], np.cumsum(moves))).tolist()
+        path_values = rng.choice(values, size=n_rows, p=probabilities)
+        target = 1
+        for value in path_values.tolist():
+            target *= value
+
+        rows = []
+        cells = [{target}]
+        remaining = target
+        for row in range(n_rows):
+            if stats is not None:
+                stats.record('row', row)
+            drawn = np.empty(row + 1, dtype=np.int64)
+            new_cells = []
+            below = path[row + 1] if row < n_rows - 1 else None
+            # the rows left can only divide a remaining target in this range
+            low = smallest ** (n_rows - 1 - row)
+            high = largest ** (n_rows - 1 - row)
+            crowded = sum(map(len, cells)) > _CONSTRUCTIVE_STATES
+            remaining //= int(path_values[row])
+            for position in range(row + 1):
+                incoming = set().union(*cells[max(position - 1, 0):
+                                             position + 1])
+                if position == path[row]:
+                    value = int(path_values[row])
+                else:
+                    if below is None:
+                        forbidden = incoming
+                    elif below - 1 <= position <= below:
+                        forbidden = {x // remaining for x in incoming
+                                     if x % remaining == 0}
+                    else:
+                        forbidden = ()
+                    forbidden = [x for x in forbidden if x <= largest]
+                    weights = probabilities
+                    if forbidden:
+                        weights = np.where(np.isin(values, forbidden), 0,
+                                           weights)
+                        if not weights.any():
+                            break
+                    if crowded and incoming:
+                        # values not dividing the lcm end every path here
+                        common = math.lcm(*incoming)
+                        ending = np.array([common % value != 0
+                                           for value in values.tolist()])
+                        if (weights * ending).any():
+                            weights = weights * ending
+                    value = int(rng.choice(values,
+                                           p=weights / weights.sum()))
+                drawn[position] = value
+                new_cells.append({x // value for x in incoming
+                                  if x % value == 0
+                                  and low <= x // value <= high})
+            if len(new_cells) < row + 1:
+                break
+            rows.append(drawn)
+            cells = new_cells
+        if len(rows) == n_rows:
+            solution = ''.join('R' if move else 'L' for move in moves)
+            return Triangle(np.concatenate(rows)), target, solution
+        if stats is not None:
+            stats.record('reject')
+
+
+def _count_paths_mitm(triangle, target, max_states=None):
+    '''
+    Helper function for TrianglePuzzle._is_valid_puzzle(). Counts the paths
+    down the triangle whose product is the target by meeting in the middle.
+
+    The top half is walked down to the middle row keeping, for every cell, a
+    hash index of remaining target -> number of paths. The bottom half is
+    walked up from the bottom row keeping, for every cell, the target divided
+    by the product of each path down from it -> number of paths. A top and a
+    bottom path below one another join when the two remaining targets
+    multiply back to the target. Both halves only keep values that divide the
+    target, and remaining targets are packed prime exponents (see
+    _PrimeExponents) so that joining is an exact sum.
+
+    Parameters
+    ----------------------------------
+    triangle : Triangle or list of lists
+    target : int
+    max_states : int, default=None
+        most remaining targets one row of either half may hold, None for no
+        limit
+
+    Returns
+    ----------------------------------
+    n_paths : int or None
+        number of paths whose product is the target, None when a row held
+        more than max_states remaining targets
+    '''
+    triangle = _as_triangle(triangle)
+    arithmetic = _PrimeExponents(target, triangle)
+    vectors = arithmetic.vectors
+    one = arithmetic.one
+    if arithmetic.target is None:
+        return 0
+    n_rows = len(triangle)
+    middle = (n_rows - 1) // 2
+
+    def step(cells, row, parents_of):
+        if cells is None:
+            return None
+        new_cells = []
+        first = row * (row + 1) // 2
+        n_states = 0
+        for position in range(row + 1):
+            vector = vectors[first + position]
+            cell = defaultdict(int)
+            for parent in parents_of(cells, position):
+                for remaining, count in parent.items():
+                    quotient = remaining - vector
+                    if quotient & one == one:
+                        cell[quotient] += count
+            new_cells.append(cell)
+            n_states += len(cell)
+            if max_states is not None and n_states > max_states:
+                return None
+        return new_cells
+
+    # Top half: remaining target -> count for each cell of the middle row
+    top = [{arithmetic.target: 1}]
+    top = step(top, 0, lambda cells, position: cells)
+    for row in range(1, middle + 1):
+        top = step(top, row,
+                   lambda cells, position: cells[max(position - 1, 0):
+                                                 position + 1])
+    if top is None:
+        return None
+    if middle == n_rows - 1:
+        return sum(index.get(one, 0) for index in top)
+
+    # Bottom half: remaining target -> count of the paths from each cell of
+    # the row below the middle down to the bottom, built from the bottom up
+    bottom = step([{arithmetic.target: 1}], n_rows - 1,
+                  lambda cells, position: cells)
+    for row in range(n_rows - 2, middle, -1):
+        bottom = step(bottom, row,
+                      lambda cells, position: cells[position:position + 2])
+    if bottom is None:
+        return None
+
+    # Join each middle cell's index with the two cells below it. The
+    # remaining targets of the two halves sum to target + one exactly when
+    # the path products multiply to the target.
+    whole = arithmetic.target + one
+    n_paths = 0
+    for position, index in enumerate(top):
+        for child in bottom[position:position + 2]:
+            if len(child) > len(index):
+                n_paths += sum(count * child.get(whole - remaining, 0)
+                               for remaining, count in index.items())
+            else:
+                n_paths += sum(count * index.get(whole - remaining, 0)
+                               for remaining, count in child.items())
+    return n_paths
+
+
+class ProductIndex:
+    '''
+    Build-once index of the products of the paths down one triangle, for
+    answering many target queries against the same triangle.
+
+    Triangles of up to max_rows rows are indexed whole: every product
+    reached maps to its number of paths and the first of them, so a query is
+    a hash lookup. Taller triangles have too many products to index, so each
+    new target is counted meet-in-the-middle (see _count_paths_mitm()) and
+    the answers for the last cache_size targets are kept, least recently
+    used first out.
+
+    Parameters
+    ----------------------------------
+    triangle : Triangle or list of lists
+    max_rows : int, default=_ENUMERATION_ROWS
+        most rows indexed whole, which bounds the index to
+        2 ** (max_rows - 1) paths
+    cache_size : int, default=1024
+        number of query answers kept, 0 keeps none
+
+    Attributes
+    ----------------------------------
+    triangle : Triangle
+    '''
+
+    def __init__(self, triangle, max_rows=_ENUMERATION_ROWS, cache_size=1024):
+        if max_rows < 1:
+            raise ValueError('max_rows must be at least 1.')
+        self.triangle = _as_triangle(triangle)
+        self.max_rows = max_rows
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._products = None
+        if len(self.triangle) <= max_rows:
+            products, counts, masks = (np.concatenate(arrays) for arrays
+                                       in zip(*self._index_rows()))
+            products, counts, masks = _merge_products(products, counts,
+                                                      masks)
+            self._products = dict(zip(products.tolist(),
+                                      zip(counts.tolist(), masks.tolist())))
+
+    def count(self, target):
+        '''
+        Returns the number of paths whose product is the target.
+        '''
+        return self._lookup(target)[0]
+
+    def paths(self, target):
+        '''
+        Returns every path whose product is the target.
+
+        Returns
+        ----------------------------------
+        paths : list of str
+            consisting of 'L' and 'R' indicating the moves of each path
+        '''
+        count, mask = self._lookup(target)
+        if count == 0:
+            return []
+        if count == 1 and mask is not None:
+            return [_solution_from_mask(mask, len(self.triangle) - 1)]
+        return list(TrianglePuzzle(self.triangle, target).iter_solutions())
+
+    def unique_targets(self):
+        '''
+        Returns the products reached by exactly one path, the targets a
+        puzzle on this triangle can have.
+        '''
+        if self._products is None:
+            raise ValueError(
+                'Only triangles of up to max_rows rows list their products.')
+        return [product for product, (count, _) in self._products.items()
+                if count == 1]
+
+    def __contains__(self, target):
+        return self.count(target) > 0
+
+    def __len__(self):
+        '''
+        Number of distinct products indexed, or of answers kept when the
+        triangle is too tall to index.
+        '''
+        if self._products is not None:
+            return len(self._products)
+        return len(self._cache)
+
+    def _lookup(self, target):
+        '''
+        Returns (number of paths, bitmask of the first path) for the target,
+        the bitmask None when the triangle is too tall to index.
+        '''
+        target = int(target)
+        if self._products is not None:
+            return self._products.get(target, (0, 0))
+        if target in self._cache:
+            self._cache.move_to_end(target)
+            return self._cache[target]
+        result = _count_paths_mitm(self.triangle, target), None
+        if self.cache_size > 0:
+            self._cache[target] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _index_rows(self):
+        '''
+        Builds, for every cell of the bottom row, the distinct products of
+        the paths down to it, their number of paths and the bitmask of the
+        first of them (bit k set when move k is 'R').
+        '''
+        n_rows = len(self.triangle)
+        mask_dtype = np.int64 if n_rows < 64 else object
+        cells = [(np.ones(1, dtype=np.int64), np.ones(1, dtype=np.int64),
+                  np.zeros(1, dtype=mask_dtype))]
+        for row in range(n_rows):
+            values = self.triangle[row]
+            new_cells = []
+            for position, value in enumerate(values.tolist()):
+                parts = []
+                if position < max(row, 1):
+                    parts.append(cells[position])
+                if position > 0:
+                    p, c, m = cells[position - 1]
+                    parts.append((p, c, m | (1 << (row - 1))))
+                products, counts, masks = zip(*parts)
+                new_cells.append(_merge_products(
+                    _scale_products(products, value),
+                    np.concatenate(counts), np.concatenate(masks)))
+            cells = new_cells
+        return cells
+
+
+def _merge_products(products, counts, masks=None):
+    '''
+    Helper function for _path_product_counts() and ProductIndex. Sums the
+    multiplicities of equal products, keeping the first of their masks when
+    masks are given.
+    '''
+    order = np.argsort(products, kind='stable')
+    products = products[order]
+    counts = counts[order]
+    starts = np.flatnonzero(np.concatenate(([True],
+                                            products[1:] != products[:-1])))
+    if masks is None:
+        return products[starts], np.add.reduceat(counts, starts)
+    return (products[starts], np.add.reduceat(counts, starts),
+            masks[order][starts])
+
+
+def evaluate_paths(triangle, paths, chunksize=1 << 16):
+    '''
+    Evaluates the products of many paths down a triangle in one call. The
+    moves of each path are summed into the position it visits on every row,
+    the visited cells are gathered from the flat triangle and multiplied
+    along each path, chunksize paths at a time (see _multiply_paths()).
+
+    Parameters
+    ----------------------------------
+    triangle : Triangle or list of lists
+    paths : array-like
+        1-D integer bitmasks with bit k set when move k is 'R' (triangles of
+        up to 65 rows), a 2-D array with one row of moves per path, 1 for
+        'R', or a list of strings of 'L' and 'R'
+    chunksize : int, default=65536
+        number of paths evaluated at a time, which bounds the memory used
+
+    Returns
+    ----------------------------------
+    products : numpy.ndarray
+        int64 when every product of the triangle fits, Python ints
+        otherwise
+    '''
+    triangle = _as_triangle(triangle)
+    paths = _as_paths(paths, len(triangle) - 1)
+    groups = _int64_row_groups(triangle)
+    products = np.empty(len(paths),
+                        dtype=np.int64 if len(groups) == 1 else object)
+    for first in range(0, len(paths), chunksize):
+        cells = _path_cells(triangle, paths[first:first + chunksize])
+        products[first:first + len(cells)] = _multiply_paths(
+            triangle.values, cells, groups)
+    return products
+
+
+def check_paths(triangle, target, paths, chunksize=1 << 16):
+    '''
+    Checks many paths against a target in one call (see evaluate_paths()).
+
+    Returns
+    ----------------------------------
+    solved : numpy.ndarray
+        bool, True for the paths whose product is the target
+    '''
+    triangle = _as_triangle(triangle)
+    paths = _as_paths(paths, len(triangle) - 1)
+    target = int(target)
+    solved = np.zeros(len(paths), dtype=bool)
+    if target < 1:
+        return solved
+    groups = _int64_row_groups(triangle)
+    for first in range(0, len(paths), chunksize):
+        cells = _path_cells(triangle, paths[first:first + chunksize])
+        solved[first:first + len(cells)] = _multiply_paths(
+            triangle.values, cells, groups, target=target)
+    return solved
+
+
+def _multiply_paths(values, cells, groups, target=None):
+    '''
+    Product kernel of evaluate_paths() and check_paths().
+
+    Rows are multiplied in groups whose product provably fits int64 (see
+    _int64_row_groups()), and only the few group products of each path are
+    multiplied as Python ints. With a target, a path is first summed in
+    log2 space and rejected there unless it is within rounding of
+    log2(target), so only the few paths that might reach it are multiplied
+    out, in int64 alone when the target itself fits.
+
+    Parameters
+    ----------------------------------
+    values : numpy.ndarray
+        flat int64 values of the triangle
+    cells : numpy.ndarray
+        flat indices of the cells of each path, one path per row
+    groups : list of slice
+    target : int, default=None
+
+    Returns
+    ----------------------------------
+    products : numpy.ndarray
+        the exact product of each path, int64 when there is one group, or
+        with a target, bool indicating the paths whose product is the target
+    '''
+    if target is None:
+        products = np.multiply.reduce(values[cells[:, groups[0]]], axis=1)
+        if len(groups) > 1:
+            products = products.astype(object)
+            for group in groups[1:]:
+                products *= np.multiply.reduce(values[cells[:, group]],
+                                               axis=1).astype(object)
+        return products
+    fits = target < 1 << 63
+    if len(groups) == 1 and fits:
+        return np.multiply.reduce(values[cells], axis=1) == target
+    # a path reaching the target sums to log2(target) within the rounding
+    # of its logs, _LOG_TOLERANCE per row being far more than that
+    bits = np.log2(values)[cells].sum(axis=1)
+    tolerance = _LOG_TOLERANCE * (cells.shape[1] + 1)
+    solved = np.zeros(len(cells), dtype=bool)
+    near = np.flatnonzero(np.abs(bits - math.log2(target)) <= tolerance)
+    if len(near):
+        # a product of values >= 1 never exceeds the target on the way to
+        # it, so paths that end near a target that fits fit throughout
+        products = _multiply_paths(values, cells[near],
+                                   [slice(None)] if fits else groups)
+        solved[near] = products == target
+    return solved
+
+
+def _int64_row_groups(triangle):
+    '''
+    Helper function for evaluate_paths() and check_paths(). Splits the rows
+    into runs whose largest values multiply to less than 2**62, so that the
+    product of any path over one run fits int64.
+
+    Returns
+    ----------------------------------
+    groups : list of slice
+        at least one, over the columns of the cells of a path
+    '''
+    groups = []
+    start, bits = 0, 0.0
+    if len(triangle):
+        largest = np.maximum.reduceat(triangle.values, triangle.offsets[:-1])
+        for row, row_bits in enumerate(np.log2(largest).tolist()):
+            if bits + row_bits >= 62 and row > start:
+                groups.append(slice(start, row))
+                start, bits = row, 0.0
+            bits += row_bits
+    groups.append(slice(start, None))
+    return groups
+
+
+def _path_cells(triangle, paths):
+    '''
+    Helper function for evaluate_paths() and check_paths(). Sums the moves
+    of a chunk of paths into the flat index of the cell each path visits on
+    every row.
+    '''
+    moves = _path_moves(paths, len(triangle) - 1)
+    positions = np.zeros((len(moves), len(triangle)), dtype=np.int64)
+    np.cumsum(moves, axis=1, out=positions[:, 1:])
+    return positions + triangle.offsets[:-1]
+
+
+def _as_paths(paths, n_moves):
+    '''
+    Helper function for evaluate_paths(). Turns strings into a 2-D array of
+    moves and checks the shape of bitmasks and moves.
+    '''
+    if isinstance(paths, str):
+        raise ValueError('Pass a list of paths, not a single path.')
+    if (not isinstance(paths, np.ndarray) and len(paths)
+            and isinstance(paths[0], str)):
+        if any(len(path) != n_moves for path in paths):
+            raise ValueError(f'Every path must have {n_moves} moves.')
+        encoded = ''.join(paths).encode('ascii')
+        moves = np.frombuffer(encoded, dtype=np.uint8) == ord('R')
+        return moves.reshape(len(paths), n_moves)
+    paths = np.asarray(paths)
+    if paths.ndim == 2:
+        if paths.shape[1] != n_moves:
+            raise ValueError(f'Every path must have {n_moves} moves.')
+        return paths
+    if paths.ndim != 1:
+        raise ValueError('Paths must be bitmasks or rows of moves.')
+    if n_moves > 64:
+        raise ValueError('Bitmasks only cover triangles of up to 65 rows, '
+                         'pass rows of moves instead.')
+    return paths.astype(np.uint64)
+
+
+def _path_moves(paths, n_moves):
+    '''
+    Helper function for evaluate_paths(). Unpacks a chunk of bitmasks into
+    rows of moves, 1 for 'R'.
+    '''
+    if paths.ndim == 2:
+        return paths.astype(np.int64, copy=False)
+    shifts = np.arange(n_moves, dtype=np.uint64)
+    return ((paths[:, None] >> shifts) & np.uint64(1)).astype(np.int64)
+
+
+def _solution_from_mask(mask, n_moves):
+    '''
+    Spells out the path of a bitmask with bit k set when move k is 'R'.
+    '''
+    return ''.join('R' if mask >> move & 1 else 'L'
+                   for move in range(n_moves))
+
+
+def _mask_from_solution(solution):
     '''
-    Helper function for TrianglePuzzle.display(). Determines the whitespace
-    preceeding items in each row.
+    Packs a path of 'L' and 'R' into a bitmask, bit k set when move k is
+    'R'.
     '''
-    if not prev and not row_indent:
-        raise ValueError('Must provide a prev value or row_indent index')
+    if solution.strip('LR'):
+        raise ValueError('A solution consists of \'L\' and \'R\' moves.')
+    return int(solution[::-1].replace('L', '0').replace('R', '1') or '0', 2)
 
-    item_len = len(str(value))
 
-    # determine baselien value of decrease from standard spacing
-    if item_len <= 2:
-        decrease = 0
-    else:
-        decrease = ((item_len - 1) // 2)
+def solve_many(puzzles, workers=None, chunksize=16, method='dp',
+               stream=False):
+    '''
+    Solves many puzzles across a pool of processes.
+
+    Triangles are sent to the workers as flat int64 buffers rather than
+    pickled lists of lists. A puzzle that cannot be solved is reported in its
+    result instead of aborting the batch.
+
+    Parameters
+    ----------------------------------
+    puzzles : iterable of TrianglePuzzle
+    workers : int, default=None
+        number of worker processes, None uses every core and 1 solves in the
+        calling process
+    chunksize : int, default=16
+        number of puzzles handed to a worker at a time
+    method : str, default='dp'
+        solver engine passed to TrianglePuzzle.solve()
+    stream : bool, default=False
+        when True, yield results as they finish instead of returning them in
+        input order
+
+    Returns
+    ----------------------------------
+    results : list or iterator of SolveResult
+    '''
+    packed = (_pack_puzzle(puzzle, index=index, method=method)
+              for index, puzzle in enumerate(puzzles))
+    results = _solve_packed_many(packed, workers, chunksize, stream)
+    if stream:
+        return results
+    return list(results)
+
+
+def generate_batch(count, n_rows=5, level=None, seed=None, workers=None,
+                   chunksize=16, method=None):
+    '''
+    Lazily generates random puzzles across a pool of processes.
+
+    Every puzzle draws from its own numpy.random.Generator, spawned in order
+    from a single SeedSequence, so the same seed yields the same puzzles no
+    matter how many workers produce them. Only a bounded window of puzzles is
+    in flight at a time.
+
+    Parameters
+    ----------------------------------
+    count : int
+        number of puzzles to generate
+    n_rows : int, default=5
+        passed to TrianglePuzzle.make_random()
+    level : str, default=None
+        passed to TrianglePuzzle.make_random()
+    seed : None, int or numpy.random.SeedSequence
+        root of the random streams, None draws fresh entropy
+    workers : int, default=None
+        number of worker processes, None uses every core and 1 generates in
+        the calling process
+    chunksize : int, default=16
+        number of puzzles handed to a worker at a time
+    method : str, default=None
+        passed to TrianglePuzzle.make_random()
+
+    Yields
+    ----------------------------------
+    puzzle : TrianglePuzzle
+    '''
+    tasks = ((child, n_rows, level, method)
+             for child in _spawn_seeds(seed, count))
+    if workers == 1:
+        for task in tasks:
+            yield _unpack_puzzle(_generate_packed(task))
+        return
+    window = (workers or os.cpu_count() or 1) * chunksize * 4
+    with multiprocessing.Pool(workers) as pool:
+        while True:
+            batch = [task for _, task in zip(range(window), tasks)]
+            if not batch:
+                break
+            for packed in pool.imap(_generate_packed, batch, chunksize):
+                yield _unpack_puzzle(packed)
+
+
+def _spawn_seeds(seed, count, block=1024):
+    '''
+    Helper function for generate_batch(). Spawns one child SeedSequence per
+    puzzle, a block at a time.
+    '''
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    for start in range(0, count, block):
+        yield from seed.spawn(min(block, count - start))
+
+
+def _generate_packed(task):
+    '''
+    Helper function for generate_batch(). Generates one packed puzzle in a
+    worker.
+    '''
+    seed, n_rows, level, method = task
+    puzzle = TrianglePuzzle().make_random(
+        n_rows=n_rows, level=level, random_state=np.random.default_rng(seed),
+        method=method)
+    return _pack_puzzle(puzzle, solution=puzzle.solution_)
+
+
+def _solve_packed_many(packed, workers, chunksize, stream):
+    '''
+    Helper function for solve_many(). Runs the packed puzzles through the
+    pool, closing it once every result has been consumed.
+    '''
+    if workers == 1:
+        yield from map(_solve_packed, packed)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        if stream:
+            yield from pool.imap_unordered(_solve_packed, packed, chunksize)
+        else:
+            yield from pool.imap(_solve_packed, packed, chunksize)
+
+
+def _pack_puzzle(puzzle, **kwargs):
+    '''
+    Helper function for solve_many(). Takes the int64 buffer behind the
+    triangle of a puzzle. A puzzle that cannot be packed, such as one without
+    a triangle, is packed as its error for the worker to report.
+
+    Returns
+    ----------------------------------
+    packed : tuple
+        (number of rows, triangle buffer, target, kwargs)
+    '''
+    try:
+        triangle = puzzle.triangle
+        return len(triangle), triangle.values.tobytes(), puzzle.target, kwargs
+    except (AttributeError, TypeError, ValueError) as error:
+        return 0, None, None, dict(kwargs, error=str(error))
+
+
+def _unpack_puzzle(packed):
+    '''
+    Rebuilds the puzzle flattened by _pack_puzzle() on top of the received
+    buffer, with its solution when one was packed.
+    '''
+    _, buffer, target, kwargs = packed
+    puzzle = TrianglePuzzle(Triangle(np.frombuffer(buffer, dtype=np.int64)),
+                            target)
+    puzzle.solution_ = kwargs.get('solution')
+    return puzzle
+
+
+def _solve_packed(packed):
+    '''
+    Helper function for solve_many(). Solves one packed puzzle in a worker.
+    '''
+    kwargs = packed[3]
+    if 'error' in kwargs:
+        return SolveResult(kwargs['index'], None, kwargs['error'])
+    puzzle = _unpack_puzzle(packed)
+    try:
+        solution = puzzle.solve(method=kwargs['method'])
+    except (ValueError, TypeError) as error:
+        return SolveResult(kwargs['index'], None, str(error))
+    return SolveResult(kwargs['index'], solution, None)
+
+
+def _search_dp(arithmetic, last_row, row, cell, remaining, dead,
+               stats=None, cancelled=None):
+    '''
+    Helper function for TrianglePuzzle.solve() and solve_parallel().
+    Left-first search of the sub-triangle below one cell for a path that
+    divides the packed remaining target down to one, adding the
+    (cell, remaining target) states that lead nowhere to dead.
+
+    Parameters
+    ----------------------------------
+    arithmetic : _PrimeExponents
+    last_row : int
+    row, cell : int
+        row and flat index of the cell the search starts from
+    remaining : int
+        packed remaining target once the value of that cell is divided out
+    dead : set
+        states known to lead nowhere, shared between searches of one puzzle
+    stats : SearchStats, default=None
+    cancelled : callable, default=None
+        polled every _CANCEL_INTERVAL nodes, the search gives up once it
+        returns True
+
+    Returns
+    ----------------------------------
+    solution : str or None
+        the moves below the cell, None when there are none or the search was
+        cancelled
+    '''
+    vectors = arithmetic.vectors
+    one = arithmetic.one
+    record = stats is not None
+    countdown = _CANCEL_INTERVAL
+
+    # Each frame holds [row, cell, remaining target, next direction] where
+    # cell indexes the flat values, and the next direction is 0 for left,
+    # 1 for right and 2 once both moves from the frame have been tried.
+    # Moving left from cell lands on cell + row + 1.
+    stack = [[row, cell, remaining, 0]]
+    while stack:
+        frame = stack[-1]
+        row, cell, remaining, direction = frame
+        if row == last_row:
+            if remaining == one:
+                return ''.join(
+                    'R' if child[1] - parent[1] > parent[0] + 1 else 'L'
+                    for parent, child in zip(stack, stack[1:]))
+            direction = 2
+        if direction == 2:
+            dead.add((cell, remaining))
+            stack.pop()
+            if record:
+                stats.record('backtrack', row, cell - row * (row + 1) // 2)
+            continue
+        frame[3] += 1
+        next_cell = cell + row + 1 + direction
+        quotient = remaining - vectors[next_cell]
+        if quotient & one != one:
+            if record:
+                stats.record('prune', row + 1,
+                             next_cell - (row + 1) * (row + 2) // 2)
+            continue
+        state = (next_cell, quotient)
+        if state not in dead:
+            stack.append([row + 1, next_cell, state[1], 0])
+            if record:
+                stats.record('node', row + 1,
+                             next_cell - (row + 1) * (row + 2) // 2)
+            if cancelled is not None:
+                countdown -= 1
+                if not countdown:
+                    if cancelled():
+                        return None
+                    countdown = _CANCEL_INTERVAL
+        elif record:
+            stats.record('memo_hit', row + 1,
+                         next_cell - (row + 1) * (row + 2) // 2)
+    return None
+
+
+def _split_search(arithmetic, split_depth, min_tasks=None):
+    '''
+    Helper function for TrianglePuzzle.solve_parallel(). Expands the search
+    row by row down to split_depth, or until there are min_tasks states,
+    keeping the first prefix to reach each (cell, remaining target) state.
+
+    Returns
+    ----------------------------------
+    tasks : list of tuples
+        (prefix, row, cell, remaining target) of every subproblem, in
+        left-first order
+    '''
+    remaining = arithmetic.divide(arithmetic.target, 0)
+    if remaining is None:
+        raise ValueError('There is no solution to this puzzle.')
+    vectors = arithmetic.vectors
+    one = arithmetic.one
+    row = 0
+    frontier = [('', 0, remaining)]
+    while row < split_depth and (min_tasks is None
+                                 or len(frontier) < min_tasks):
+        seen = set()
+        expanded = []
+        for prefix, cell, remaining in frontier:
+            for direction, move in enumerate('LR'):
+                next_cell = cell + row + 1 + direction
+                quotient = remaining - vectors[next_cell]
+                if (quotient & one == one
+                        and (next_cell, quotient) not in seen):
+                    seen.add((next_cell, quotient))
+                    expanded.append((prefix + move, next_cell, quotient))
+        frontier = expanded
+        row += 1
+    return [(prefix, row, cell, remaining)
+            for prefix, cell, remaining in frontier]
+
+
+# state of a solve_parallel() worker, set by _init_search_worker()
+_SEARCH = None
+
+
+def _init_search_worker(values, target, found):
+    '''
+    Helper function for TrianglePuzzle.solve_parallel(). Sets a worker up
+    on the shared triangle values, with an empty set of dead states.
+    '''
+    global _SEARCH
+    triangle = Triangle(np.frombuffer(values, dtype=np.int64))
+    _SEARCH = (_PrimeExponents(target, triangle), len(triangle) - 1, found,
+               set())
+
+
+def _search_task(task):
+    '''
+    Helper function for TrianglePuzzle.solve_parallel(). Searches one
+    subproblem in a worker, giving up once a subproblem to its left has a
+    solution, and publishes its own solution to the other workers.
+    '''
+    index, (_, row, cell, remaining) = task
+    arithmetic, last_row, found, dead = _SEARCH
+
+    def cancelled():
+        return found.value < index
+
+    if cancelled():
+        return index, None
+    solution = _search_dp(arithmetic, last_row, row, cell, remaining, dead,
+                          cancelled=cancelled)
+    if solution is not None:
+        with found.get_lock():
+            found.value = min(found.value, index)
+    return index, solution
+
+
+def iter_txt_puzzles(path):
+    '''
+    Reads the puzzles of a multi-puzzle .txt file one at a time.
+
+    The file is memory-mapped and scanned line by line, so only the puzzle
+    being read is held in memory. Each puzzle is laid out as
+    TrianglePuzzle.display() writes it and starts at its target line, or at
+    its top row when it has none. A solution line, when present, is kept as
+    the puzzle's solution_.
+
+    Parameters
+    ----------------------------------
+    path : str
+        indicating the path to the text file
+
+    Yields
+    ----------------------------------
+    puzzle : TrianglePuzzle
+    '''
+    with open(path, 'rb') as txt_file:
+        if os.fstat(txt_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(txt_file.fileno(), 0,
+                       access=mmap.ACCESS_READ) as lines:
+            for rows, target, solution in iter_txt_records(
+                    line.decode('ascii')
+                    for line in iter(lines.readline, b'')):
+                puzzle = TrianglePuzzle(rows, target)
+                puzzle.solution_ = solution
+                yield puzzle
+
+
+class PuzzleTxtWriter:
+    '''
+    Writes puzzles to a multi-puzzle .txt file through one buffered handle,
+    in the layout read back by iter_txt_puzzles(). Use it as a context
+    manager or call close() when done.
+
+    Parameters
+    ----------------------------------
+    path : str
+        indicates the path to the file to which you want to save the puzzles
+    mode : str, default='a'
+        'a' appends to an existing file and 'w' starts a new one
+    show_solution : bool, default=False
+        indicates whether or not to include the solutions
+    spacing : int, default=4
+        indicates the degree of spacing between consecutive values a same
+        row of the triangle
+    line_spacing : int, default=1
+        indicates the degree of spacing between rows of the triangle and
+        between the target, triangle, and solution
+    buffering : int, default=1048576
+        size in bytes of the write buffer
+    '''
+
+    def __init__(self, path, mode='a', show_solution=False, spacing=4,
+                 line_spacing=1, buffering=1 << 20):
+        if mode not in ('a', 'w'):
+            raise ValueError('Options for mode are \'a\' or \'w\'.')
+        self.show_solution = show_solution
+        self.spacing = spacing
+        self.line_spacing = line_spacing
+        self._file = open(path, mode, buffering=buffering)
+
+    def write(self, puzzle):
+        '''
+        Appends one puzzle to the file.
+        '''
+        self.write_many((puzzle,))
+
+    def write_many(self, puzzles):
+        '''
+        Appends a batch of puzzles to the file.
+
+        Returns
+        ----------------------------------
+        n_written : int
+        '''
+        return render_puzzles(puzzles, self._file,
+                              show_solution=self.show_solution,
+                              spacing=self.spacing,
+                              line_spacing=self.line_spacing)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def render_puzzles(puzzles, stream, show_solution=False, spacing=4,
+                   line_spacing=1):
+    '''
+    Writes many puzzles to a text stream in one pass, separated by blank
+    lines, in the layout of TrianglePuzzle.display().
+
+    Parameters
+    ----------------------------------
+    puzzles : iterable of TrianglePuzzle
+    stream : file-like
+        text stream to write the puzzles to
+    show_solution : bool, default=False
+        indicates whether or not to include the solutions
+    spacing : int, default=4
+        indicates the degree of spacing between consecutive values a same
+        row of the triangle
+    line_spacing : int, default=1
+        indicates the degree of spacing between rows of the triangle and
+        between the target, triangle, and solution
+
+    Returns
+    ----------------------------------
+    n_written : int
+    '''
+    write = stream.write
+    n_written = 0
+    for puzzle in puzzles:
+        puzzle._render(write, show_solution=show_solution, spacing=spacing,
+                       line_spacing=line_spacing)
+        write('\n')
+        n_written += 1
+    return n_written
+
+
+def write_txt_puzzles(puzzles, path, mode='a', **kwargs):
+    '''
+    Writes a batch of puzzles to a multi-puzzle .txt file. Keyword arguments
+    are passed to PuzzleTxtWriter.
+
+    Returns
+    ----------------------------------
+    n_written : int
+    '''
+    with PuzzleTxtWriter(path, mode=mode, **kwargs) as writer:
+        return writer.write_many(puzzles)
+
+
+def _as_triangle(triangle):
+    '''
+    Returns the triangle as a Triangle, converting lists of lists.
+    '''
+    if isinstance(triangle, Triangle):
+        return triangle
+    return Triangle.from_rows(triangle)
+
+
+def _check_random_state(random_state):
+    '''
+    Turns None, an int seed, a Generator or a RandomState into an object
+    with numpy's choice() method, None being the global numpy.random state.
+    '''
+    if random_state is None:
+        return np.random
+    if isinstance(random_state, (np.random.Generator,
+                                 np.random.RandomState)):
+        return random_state
+    return np.random.default_rng(random_state)
 
-    # row_indent is used when the item is the first in its row
-    if row_indent:
-        indent = (' ' * ((spacing * row_indent) - decrease))
-        return indent
 
-    # prev indicates the previous value in the row
-    if prev:
-        prev_len = len(str(prev))
-        decrease += ((prev_len // 2) + 1)
-        indent = (' ' * ((spacing * 2) - decrease))
-        return indent
+class Triangle:
+    '''
+    Compact storage for the values of a triangle: one contiguous array holding
+    the rows one after another and the offset at which each row starts.
+
+    A Triangle is indexed like a list of lists. triangle[row] is a view of the
+    row, triangle[row, position] is the value at that cell as an int, and
+    iterating over it yields the rows.
+
+    Parameters
+    ----------------------------------
+    values : array-like
+        positive integers below 2**63, row by row. The length must be a
+        triangular number.
+
+    Attributes
+    ----------------------------------
+    values : numpy.ndarray
+        int64 array of every value in the triangle
+    offsets : numpy.ndarray
+        offsets[row] is the index in values of the first value of the row, and
+        offsets[-1] is the number of values
+    '''
+
+    __slots__ = ('values', 'offsets')
+
+    def __init__(self, values):
+        try:
+            values = np.asarray(values)
+            # unsigned and Python ints past int64 would wrap or overflow
+            if (values.dtype.kind in 'uOf' and values.size
+                    and values.max() > _INT64_MAX):
+                raise OverflowError
+            values = values.astype(np.int64, copy=False)
+        except OverflowError:
+            raise ValueError('The values of the triangle must fit in int64, '
+                             'below 2**63.') from None
+        except (TypeError, ValueError):
+            print('Could not convert one or more values to an int.')
+            raise
+        if values.ndim != 1:
+            raise ValueError('The triangle is not the correct shape.')
+        n_rows = int((np.sqrt(8 * values.size + 1) - 1) // 2)
+        if n_rows * (n_rows + 1) // 2 != values.size:
+            raise ValueError('The triangle is not the correct shape.')
+        if values.size and values.min() < 1:
+            raise ValueError('The values of the triangle must be positive.')
+        rows = np.arange(n_rows + 1)
+        self.values = values
+        self.offsets = rows * (rows + 1) // 2
+
+    @classmethod
+    def from_rows(cls, rows):
+        '''
+        Builds a Triangle from a list of lists.
+
+        Parameters
+        ----------------------------------
+        rows : list of lists
+            lists consist of positive integers below 2**63 and each list must
+            be one item longer than the one previous
+
+        Returns
+        ----------------------------------
+        triangle : Triangle
+        '''
+        rows = list(rows)
+        for row, values in enumerate(rows):
+            if len(values) != row + 1:
+                raise ValueError('The triangle is not the correct shape.')
+        if not rows:
+            return cls(np.empty(0, dtype=np.int64))
+        arrays = [np.asarray(values) for values in rows]
+        if any(array.dtype.kind in 'uOf' for array in arrays):
+            # ints past int64 come out as uint64, floats or objects, so the
+            # rows are kept as Python ints for Triangle() to check
+            arrays = [np.array(values, dtype=object) for values in rows]
+        return cls(np.concatenate(arrays))
+
+    def tolist(self):
+        '''
+        Returns the triangle as a list of lists of ints.
+        '''
+        values = self.values.tolist()
+        offsets = self.offsets.tolist()
+        return [values[start:stop]
+                for start, stop in zip(offsets[:-1], offsets[1:])]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            row, position = key
+            if not 0 <= position <= row:
+                raise IndexError('position is outside of the row')
+            return int(self.values[self.offsets[row] + position])
+        if isinstance(key, slice):
+            return [self[row] for row in range(len(self))[key]]
+        row = range(len(self))[key]
+        return self.values[self.offsets[row]:self.offsets[row + 1]]
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self.values[self.offsets[row]:self.offsets[row + 1]]
+
+    def __eq__(self, other):
+        if not isinstance(other, Triangle):
+            return NotImplemented
+        return np.array_equal(self.values, other.values)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'Triangle({self.tolist()})'
+
+
+class _PrimeExponents:
+    '''
+    Exact arithmetic on the quotients of one target by the values of one
+    triangle, done on prime exponent vectors instead of on the integers.
+
+    The target and every distinct value of the triangle are factored once.
+    An exponent vector over the primes of the target is packed into a single
+    int with one field per prime, each field one guard bit wider than the
+    largest exponent in the target. A remaining target keeps every guard bit
+    set, so dividing it by a value is a subtraction of the value's vector and
+    the division is exact when no guard bit was borrowed:
+
+        quotient = remaining - vector
+        quotient & one == one
+
+    Values with a prime the target lacks, or with too high a power of one,
+    are packed so that this check always fails.
+
+    Parameters
+    ----------------------------------
+    target : int
+    triangle : Triangle
+
+    Attributes
+    ----------------------------------
+    target : int or None
+        packed target, None when it has a prime factor no value has
+    one : int
+        packed remaining target once it has been divided down to 1
+    vectors : list of int
+        packed exponent vector of the value in each cell, in flat order
+    '''
+
+    __slots__ = ('target', 'one', 'vectors')
+
+    def __init__(self, target, triangle):
+        values, inverse = np.unique(triangle.values, return_inverse=True)
+        factors = [_prime_factors(value) for value in values.tolist()]
+
+        target = int(target)
+        exponents = {}
+        if target >= 1:
+            for prime in sorted(set().union(*factors)):
+                exponent = 0
+                while target % prime == 0:
+                    target //= prime
+                    exponent += 1
+                if exponent:
+                    exponents[prime] = exponent
+
+        width = max(exponents.values(), default=0).bit_length() + 1
+        guard = 1 << (width - 1)
+        shifts = {prime: width * i for i, prime in enumerate(exponents)}
+        self.one = sum(guard << (width * i)
+                       for i in range(max(len(shifts), 1)))
+        if target == 1:
+            self.target = self.one + sum(exponent << shifts[prime]
+                                         for prime, exponent
+                                         in exponents.items())
+        else:
+            self.target = None
+
+        packed = []
+        for value_factors in factors:
+            vector = 0
+            for prime, exponent in value_factors.items():
+                if prime not in shifts:
+                    vector = guard
+                    break
+                vector += min(exponent, guard) << shifts[prime]
+            packed.append(vector)
+        self.vectors = [packed[i] for i in inverse.ravel().tolist()]
+
+    def divide(self, remaining, cell):
+        '''
+        Divides the packed remaining target by the value in the cell.
+
+        Returns
+        ----------------------------------
+        quotient : int or None
+            packed quotient, None when the value does not divide it
+        '''
+        if remaining is None:
+            return None
+        quotient = remaining - self.vectors[cell]
+        if quotient & self.one != self.one:
+            return None
+        return quotient
+
+    def multiply(self, remaining, cell):
+        '''
+        Multiplies the packed remaining target by the value in the cell,
+        undoing self.divide().
+        '''
+        return remaining + self.vectors[cell]
+
+
+def _small_primes(limit):
+    '''
+    Returns the primes up to limit from a table that is sieved once and
+    grown as needed.
+    '''
+    global _PRIME_TABLE
+    if _PRIME_TABLE[-1] < limit:
+        size = max(limit, 2 * int(_PRIME_TABLE[-1])) + 1
+        sieve = np.ones(size, dtype=bool)
+        sieve[:2] = False
+        for i in range(2, int(size ** 0.5) + 1):
+            if sieve[i]:
+                sieve[i * i::i] = False
+        _PRIME_TABLE = np.flatnonzero(sieve)
+    return _PRIME_TABLE[:np.searchsorted(_PRIME_TABLE, limit, side='right')]
+
+
+def _prime_factors(value):
+    '''
+    Factors a positive int by trial division against the small-prime table,
+    splitting whatever is left with Pollard's rho.
+
+    Returns
+    ----------------------------------
+    factors : dict
+        prime -> exponent
+    '''
+    factors = {}
+    primes = _small_primes(min(int(value ** 0.5) + 1, _PRIME_TABLE_LIMIT))
+    for prime in primes[value % primes == 0].tolist():
+        exponent = 0
+        while value % prime == 0:
+            value //= prime
+            exponent += 1
+        factors[prime] = exponent
+    # Whatever is left has no factor in the table, so it is prime below
+    # _PRIME_TABLE_LIMIT ** 2 and a product of large primes above that.
+    cofactors = [value] if value > 1 else []
+    while cofactors:
+        cofactor = cofactors.pop()
+        if cofactor < _PRIME_TABLE_LIMIT ** 2 or _is_prime(cofactor):
+            factors[cofactor] = factors.get(cofactor, 0) + 1
+        else:
+            divisor = _pollard_rho(cofactor)
+            cofactors += [divisor, cofactor // divisor]
+    return factors
+
+
+# Miller-Rabin with these bases is exact below 3.3 * 10 ** 24
+_MILLER_RABIN_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+
+def _is_prime(n):
+    '''
+    Helper function for _prime_factors(). Miller-Rabin primality test, exact
+    for every int64 value.
+    '''
+    if n < 2:
+        return False
+    for base in _MILLER_RABIN_BASES:
+        if n % base == 0:
+            return n == base
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for base in _MILLER_RABIN_BASES:
+        x = pow(base, d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def _pollard_rho(n):
+    '''
+    Helper function for _prime_factors(). Finds a nontrivial divisor of an
+    odd composite n with Brent's variant of Pollard's rho.
+    '''
+    for c in itertools.count(1):
+        y, r, q = 2, 1, 1
+        g = 1
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y * y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(128, r - k)):
+                    y = (y * y + c) % n
+                    q = q * abs(x - y) % n
+                g = math.gcd(q, n)
+                k += 128
+            r *= 2
+        if g == n:
+            # the batch overshot, step back one value at a time
+            g = 1
+            while g == 1:
+                ys = (ys * ys + c) % n
+                g = math.gcd(abs(x - ys), n)
+        if g != n:
+            return g
+
+
+class SearchStats:
+    '''
+    Counters and phase timings of one instrumented search, filled in by
+    TrianglePuzzle.solve() and TrianglePuzzle.make_random() when they are
+    asked for stats.
+
+    Events recorded by the solvers are 'node' (a move made), 'prune' (a move
+    ruled out because the value does not divide the remaining target),
+    'backtrack' (a dead end left), 'recompute' (a value multiplied back into
+    the remaining target while backtracking), 'memo_hit' (a move into a state
+    already known to be dead) and 'solution'. The generator records
+    'triangle' (a triangle started), 'row' (a row drawn by the incremental
+    generator), 'resample' (a row thrown away), 'candidate' (a target tried),
+    'capped' (a target given up as too costly to certify) and 'reject' (a
+    triangle thrown away).
+
+    Parameters
+    ----------------------------------
+    callback : callable, default=None
+        called as callback(event, row, position) on every event. row and
+        position locate the cell involved, None for generator events.
+
+    Attributes
+    ----------------------------------
+    counts : dict
+        event -> number of times it was recorded
+    phases : dict
+        phase name -> seconds spent in it
+    '''
+
+    __slots__ = ('counts', 'phases', 'callback')
+
+    def __init__(self, callback=None):
+        self.counts = defaultdict(int)
+        self.phases = defaultdict(float)
+        self.callback = callback
+
+    def record(self, event, row=None, position=None):
+        '''
+        Counts one event and passes it to the callback.
+        '''
+        self.counts[event] += 1
+        if self.callback is not None:
+            self.callback(event, row, position)
+
+    @property
+    def nodes_expanded(self):
+        return self.counts['node']
+
+    @property
+    def backtracks(self):
+        return self.counts['backtrack']
+
+    @property
+    def prunes(self):
+        return self.counts['prune']
+
+    @property
+    def recomputations(self):
+        return self.counts['recompute']
+
+    def as_dict(self):
+        '''
+        Returns the counts and phase timings as plain dicts.
+        '''
+        return {'counts': dict(self.counts), 'phases': dict(self.phases)}
+
+    def __repr__(self):
+        return f'SearchStats({self.as_dict()})'
+
+
+@contextlib.contextmanager
+def _phase(stats, name):
+    '''
+    Times the body into stats.phases[name], doing nothing without stats.
+    '''
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.phases[name] += time.perf_counter() - start
 
 
 class TriangleSolutionTracker:
@@ -469,22 +2442,38 @@ class TriangleSolutionTracker:
 
     Attributes
     ----------------------------------
-    output : list
-        list of type str ('L' and 'R') indicating moves taken by the solver in
-        its current path.
+    mask : int
+        moves taken by the solver in its current path, bit k set when move k
+        is 'R'
+    n_moves : int
+        number of moves in the current path
     values : list
         list of type int indicating values visited along its current path
     current_position : int
     current_row : int
+    stats : SearchStats or None
+        where the solver records its search events, if anywhere
     '''
 
+    __slots__ = ('mask', 'n_moves', 'values', 'current_position',
+                 'current_row', 'stats')
+
     def __init__(self):
-        self.output = []
+        self.mask = 0
+        self.n_moves = 0
         self.values = []
         self.current_position = 0
         self.current_row = 0
+        self.stats = None
+
+    @property
+    def output(self):
+        '''
+        The moves of the current path as a string of 'L' and 'R'.
+        '''
+        return _solution_from_mask(self.mask, self.n_moves)
 
-    def _update(self, values=None, output=None,
+    def _update(self, values=None, mask=None, n_moves=None,
                 current_position=None, current_row=None):
         '''
         Function to update the parameters of the solution tracker.
@@ -493,8 +2482,10 @@ class TriangleSolutionTracker:
         '''
         if values:
             self.values = values
-        if output:
-            self.output = output
+        if mask is not None:
+            self.mask = mask
+        if n_moves is not None:
+            self.n_moves = n_moves
         if current_position:
             self.current_position = current_position
         if current_row:
@@ -518,12 +2509,30 @@ class TriangleSolutionTracker:
         self.values.append(value)
         self.current_row += 1
         if not direction:
-            return
-        if direction == 'L':
-            self.output.append(direction)
-        elif direction == 'R':
-            self.output.append(direction)
-            self.current_position += 1
             return self
-        else:
+        if direction == 'R':
+            self.mask |= 1 << self.n_moves
+            self.current_position += 1
+        elif direction != 'L':
             raise ValueError('direction argument must be \'R\' or \'L\'.')
+        self.n_moves += 1
+        return self
+
+    def _undo_move(self):
+        '''
+        Takes the last move back.
+
+        Returns
+        ----------------------------------
+        direction : str
+            'L' or 'R', the direction of the move taken back
+        '''
+        self.values.pop()
+        self.current_row -= 1
+        self.n_moves -= 1
+        bit = 1 << self.n_moves
+        if self.mask & bit:
+            self.mask ^= bit
+            self.current_position -= 1
+            return 'R'
+        return 'L'
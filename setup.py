@@ -20,8 +20,11 @@ setuptools.setup(
     long_description_content_type='text/markdown',
     url='https://github.com/jojordan3/my-little-puzzles',
     packages=setuptools.find_packages(),
-    python_requires='>=3.5',
+    python_requires='>=3.9',
     install_requires=REQUIRED,
+    entry_points={
+        'console_scripts': ['little-puzzles=little_puzzles.cli:main'],
+    },
     classifiers=[
         'Programming Language :: Python :: 3',
         'License :: OSI Approved :: MIT License',